@@ -31,7 +31,15 @@ def set_properties(project):
 
     project.include_file("venv_bootstrap", "res/venv-bootstrap.py")
 
-    project.set_property('distutils_entry_points', {'console_scripts': ['venv-bootstrap-install=venv_bootstrap.cli:main']})
+    project.set_property('distutils_entry_points', {'console_scripts': [
+        'venv-bootstrap-install=venv_bootstrap.cli:main',
+        'venv-bootstrap-wheelhouse=venv_bootstrap.cli:wheelhouse',
+        'venv-bootstrap-prune-store=venv_bootstrap.cli:prune_store',
+        'venv-bootstrap-gc=venv_bootstrap.cli:gc',
+        'venv-bootstrap-snapshot=venv_bootstrap.cli:snapshot',
+        'venv-bootstrap-prepare=venv_bootstrap.cli:prepare',
+        'venv-bootstrap-verify=venv_bootstrap.cli:verify',
+    ]})
     project.set_property('filter_resources_glob', ['**/venv_bootstrap/__init__.py'])
     project.set_property("distutils_classifiers", [
         'Development Status :: 3 - Alpha',
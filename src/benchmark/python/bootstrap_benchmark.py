@@ -0,0 +1,321 @@
+"""venv-bootstrap.py latency benchmarks
+
+Measures cold bootstrap, warm start, reinstall after an install spec change and concurrent
+launches of venv-bootstrap.py against a local package index, so that no network access is
+needed and results are comparable between runs and releases.
+
+The index serves wheels from --wheelhouse, which must contain wheels for example1 and its
+dependencies (e.g. as made by "venv-bootstrap-wheelhouse DIR example1"), plus a synthetic
+tree of pure python distributions generated on the fly. Each scenario is reported as one
+JSON object per line.
+"""
+
+import argparse
+import base64
+import hashlib
+import http.server
+import json
+import os
+import re
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zipfile
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'src', 'main', 'python'))
+
+from venv_bootstrap.installer import Installer  # noqa
+
+EXAMPLE1_DIST = 'venv-bootstrap.py-example1'
+EXAMPLE1_MODULE = 'venv_bootstrap_py_example1'
+TREE_ROOT = 'bench-tree-0-0'
+
+
+def normalize(name):
+    # PEP 503
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def make_wheel(wheel_dir, name, version, requires=(), module_lines=100):
+    """write a minimal pure python wheel, returning its file name"""
+
+    dist = re.sub(r'[-.]+', '_', name)
+    dist_info = '{}-{}.dist-info'.format(dist, version)
+    fname = '{}-{}-py3-none-any.whl'.format(dist, version)
+
+    imports = ''.join('import {}\n'.format(re.sub(r'[-.]+', '_', i)) for i in requires)
+    functions = ''.join('def f{0}(x):\n    return x + {0}\n\n\n'.format(i) for i in range(module_lines))
+    requires_dist = ''.join('Requires-Dist: {}\n'.format(i) for i in requires)
+
+    files = [
+        ('{}/__init__.py'.format(dist), imports + functions),
+        (dist_info + '/METADATA', 'Metadata-Version: 2.1\nName: {}\nVersion: {}\n'.format(name, version) + requires_dist),
+        (
+            dist_info + '/WHEEL',
+            'Wheel-Version: 1.0\nGenerator: bootstrap_benchmark\nRoot-Is-Purelib: true\nTag: py3-none-any\n'
+        ),
+    ]
+
+    record = []
+
+    with zipfile.ZipFile(os.path.join(wheel_dir, fname), 'w') as z:
+        for path, contents in files:
+            data = contents.encode()
+            z.writestr(path, data)
+            digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode()
+            record.append('{},sha256={},{}\n'.format(path, digest, len(data)))
+
+        record.append('{}/RECORD,,\n'.format(dist_info))
+        z.writestr(dist_info + '/RECORD', ''.join(record))
+
+    return fname
+
+
+def make_tree(wheel_dir, depth, fanout, version='1.0'):
+    """generate a tree of distributions rooted at TREE_ROOT, each level depending on the next one"""
+
+    count = 0
+
+    for level in range(depth + 1):
+        for index in range(fanout ** level):
+            requires = [] if level == depth else [
+                'bench-tree-{}-{}'.format(level + 1, index * fanout + i) for i in range(fanout)
+            ]
+            make_wheel(wheel_dir, 'bench-tree-{}-{}'.format(level, index), version, requires)
+            count += 1
+
+    make_wheel(wheel_dir, 'bench-extra', version)
+
+    return count + 1
+
+
+class IndexHandler(http.server.BaseHTTPRequestHandler):
+    # set by serve_index()
+    wheel_dirs = []
+    latency = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _files(self):
+        for wheel_dir in self.wheel_dirs:
+            for fname in os.listdir(wheel_dir):
+                if fname.endswith('.whl'):
+                    yield fname, os.path.join(wheel_dir, fname)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+
+        parts = [i for i in urllib.parse.unquote(urllib.parse.urlparse(self.path).path).split('/') if i]
+
+        if parts == ['simple']:
+            projects = sorted(set(normalize(i.split('-')[0]) for i, _ in self._files()))
+            links = ''.join('<a href="/simple/{0}/">{0}</a>\n'.format(i) for i in projects)
+            self._send('<!DOCTYPE html>\n<html><body>\n{}</body></html>\n'.format(links).encode(), 'text/html')
+
+        elif len(parts) == 2 and parts[0] == 'simple':
+            links = []
+
+            for fname, path in sorted(self._files()):
+                if normalize(fname.split('-')[0]) == normalize(parts[1]):
+                    with open(path, 'rb') as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()
+                    links.append('<a href="/files/{0}#sha256={1}">{0}</a>\n'.format(fname, digest))
+
+            if not links:
+                self.send_error(404)
+                return
+
+            self._send('<!DOCTYPE html>\n<html><body>\n{}</body></html>\n'.format(''.join(links)).encode(), 'text/html')
+
+        elif len(parts) == 2 and parts[0] == 'files':
+            for fname, path in self._files():
+                if fname == parts[1]:
+                    with open(path, 'rb') as f:
+                        self._send(f.read(), 'application/octet-stream')
+                    return
+
+            self.send_error(404)
+
+        else:
+            self.send_error(404)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def serve_index(wheel_dirs, latency):
+    """start a PEP 503 index in a background thread, returning the server and its "simple" URL"""
+
+    handler = type('Handler', (IndexHandler,), {'wheel_dirs': wheel_dirs, 'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://127.0.0.1:{}/simple'.format(server.server_address[1])
+
+
+class Bench:
+    def __init__(self, args, index_url, work_dir):
+        self.args = args
+        self.index_url = index_url
+        self.work_dir = work_dir
+        self.counter = 0
+
+        self.env = dict(os.environ)
+        # keep benchmarks away from the user's cache (templates, store, ...)
+        self.env['VENV_BOOTSTRAP_PY_CACHE'] = os.path.join(work_dir, 'cache')
+        for i in ['VENV_BOOTSTRAP_PY_ENV', 'VENV_BOOTSTRAP_PY_WHEELHOUSE']:
+            self.env.pop(i, None)
+
+    def new_script(self):
+        self.counter += 1
+        script_dir = os.path.join(self.work_dir, 'script{}'.format(self.counter))
+        os.mkdir(script_dir)
+        installer = Installer(script_dir)
+        installer.install()
+
+        return installer.fname
+
+    def spec(self, *extra):
+        return ' '.join(['-i', self.index_url, EXAMPLE1_DIST, TREE_ROOT] + list(extra))
+
+    def start(self, script, spec):
+        return subprocess.Popen(
+            # the bundled pip, as the latest one would be downloaded from PyPI into each fresh cache
+            [sys.executable, script, '--no-pip-upgrade'] + self.args.script_arg + [EXAMPLE1_MODULE, spec, 'succeed', 'ok'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self.env,
+            universal_newlines=True
+        )
+
+    def run(self, script, spec):
+        start = time.perf_counter()
+
+        with self.start(script, spec) as process:
+            stdout, stderr = process.communicate()
+
+        elapsed = time.perf_counter() - start
+        ok = process.returncode == 0 and stdout == 'ok\n'
+
+        if not ok:
+            sys.stderr.write(stderr)
+
+        return elapsed, ok
+
+    def report(self, scenario, times, ok, **extra):
+        result = dict(
+            scenario=scenario,
+            ok=ok,
+            runs=len(times),
+            times=times,
+            min=min(times),
+            median=statistics.median(times),
+            max=max(times),
+            latency=self.args.latency,
+            python=sys.version.split()[0],
+            platform=sys.platform,
+            timestamp=time.time()
+        )
+        result.update(extra)
+
+        self.args.output.write(json.dumps(result, sort_keys=True) + '\n')
+        self.args.output.flush()
+
+    def cold(self):
+        times, oks = zip(*[self.run(self.new_script(), self.spec()) for i in range(self.args.cold_runs)])
+        self.report('cold', list(times), all(oks))
+
+    def warm(self):
+        script = self.new_script()
+        _, ok = self.run(script, self.spec())
+        times, oks = zip(*[self.run(script, self.spec()) for i in range(self.args.warm_runs)])
+        self.report('warm', list(times), ok and all(oks))
+
+    def respec(self):
+        times = []
+        oks = []
+
+        for i in range(self.args.cold_runs):
+            script = self.new_script()
+            _, ok = self.run(script, self.spec())
+            elapsed, respec_ok = self.run(script, self.spec('bench-extra'))
+            times.append(elapsed)
+            oks += [ok, respec_ok]
+
+        self.report('respec', times, all(oks))
+
+    def concurrent(self):
+        script = self.new_script()
+        start = time.perf_counter()
+        processes = [self.start(script, self.spec()) for i in range(self.args.concurrency)]
+        times = []
+        ok = True
+
+        for process in processes:
+            with process:
+                stdout, stderr = process.communicate()
+            times.append(time.perf_counter() - start)
+            ok = ok and process.returncode == 0 and stdout == 'ok\n'
+
+        self.report('concurrent', times, ok, concurrency=self.args.concurrency, wall=max(times))
+
+
+SCENARIOS = ['cold', 'warm', 'respec', 'concurrent']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--wheelhouse', metavar='PATH', required=True, help='directory with wheels of example1 and its dependencies'
+    )
+    parser.add_argument('--latency', metavar='SECONDS', type=float, default=0, help='delay added to every index request')
+    parser.add_argument('--tree-depth', metavar='N', type=int, default=2, help='depth of the synthetic dependency tree')
+    parser.add_argument('--tree-fanout', metavar='N', type=int, default=3, help='fanout of the synthetic dependency tree')
+    parser.add_argument('--cold-runs', metavar='N', type=int, default=1, help='number of cold and respec runs')
+    parser.add_argument('--warm-runs', metavar='N', type=int, default=10, help='number of warm runs')
+    parser.add_argument('--concurrency', metavar='N', type=int, default=4, help='number of concurrent launches')
+    parser.add_argument(
+        '--script-arg', metavar='ARG', action='append', default=[],
+        help='extra option to pass to venv-bootstrap.py, e.g. --script-arg=--template'
+    )
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout, help='where to write JSON lines')
+    parser.add_argument('scenario', nargs='*', help='scenarios to run, of: {} (default: all)'.format(', '.join(SCENARIOS)))
+    args = parser.parse_args()
+
+    for i in args.scenario:
+        if i not in SCENARIOS:
+            parser.error('unknown scenario "{}"'.format(i))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tree_dir = os.path.join(work_dir, 'tree')
+        os.mkdir(tree_dir)
+        make_tree(tree_dir, args.tree_depth, args.tree_fanout)
+
+        server, index_url = serve_index([os.path.abspath(args.wheelhouse), tree_dir], args.latency)
+
+        try:
+            bench = Bench(args, index_url, work_dir)
+
+            for i in args.scenario or SCENARIOS:
+                getattr(bench, i)()
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
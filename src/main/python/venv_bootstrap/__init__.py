@@ -1,6 +1,22 @@
+import sys
+
 __version__ = '${version}'
 
 if __version__[0] == '$':
     # running from non installed sources, probably unittests
-    import setuptools_scm
-    __version__ = setuptools_scm.get_version()
+    del __version__
+
+    def _get_version():
+        import setuptools_scm
+        return setuptools_scm.get_version()
+
+    if sys.version_info < (3, 7):
+        __version__ = _get_version()
+    else:
+        def __getattr__(name):
+            # setuptools_scm takes a long time to import, so this is only done when needed
+            if name == '__version__':
+                globals()['__version__'] = _get_version()
+                return __version__
+
+            raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
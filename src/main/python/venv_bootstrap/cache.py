@@ -0,0 +1,37 @@
+import os
+
+# files of venvs made by venv-bootstrap.py, keep in sync with it
+STAMP_FNAME = 'venv-bootstrap.stamp'
+FINGERPRINT_FNAME = 'venv-bootstrap.install'
+TEMPLATE_FNAME = 'venv-bootstrap.template'
+LOCK_FNAME = 'venv-bootstrap.lock'
+BUNDLE_FNAME = 'venv-bootstrap.bundle.zip'
+USED_FNAME = 'venv-bootstrap.used'
+INUSE_FNAME = 'venv-bootstrap.inuse'
+LAUNCH_FNAME = 'venv-bootstrap.launch'
+
+
+def try_lock(fd):
+    """take the exclusive lock venv-bootstrap.py takes on LOCK_FNAME without waiting, returning whether it succeeded"""
+
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+
+    return True
+
+
+def default_cache_dir():
+    # keep in sync with default_cache_dir() in venv-bootstrap.py
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(base, 'venv-bootstrap.py')
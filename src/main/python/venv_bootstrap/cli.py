@@ -1,6 +1,28 @@
 import click
+import collections
+import itertools
+import os
 import sys
-from .installer import Installer
+import time
+from . import snapshots
+from . import store
+from . import venvs
+from .cache import default_cache_dir
+from .discovery import find_targets
+from .installer import CheckCache, Installer, SCRIPT_FNAME
+
+
+def _unique_dirs(dirs):
+    """yield dirs, leaving out those already yielded, possibly under another name"""
+
+    seen = set()
+
+    for i in dirs:
+        real = os.path.realpath(i)
+
+        if real not in seen:
+            seen.add(real)
+            yield i
 
 
 @click.command()
@@ -10,6 +32,17 @@ from .installer import Installer
 @click.option('--downgrade', is_flag=True, help='downgrade existing files to this version')
 @click.option('--force', is_flag=True, help='override existing venv-bootstrap.py files that do not look like our file')
 @click.option('--no-interactive', is_flag=True, help='disable prompts')
+@click.option('--no-cache', is_flag=True, help='do not use or update the cache of results of checking existing files')
+@click.option(
+    '--jobs', default=1, metavar='N', type=click.IntRange(1), show_default=True,
+    help='number of directories to check and install into in parallel'
+)
+@click.option(
+    '--recursive', metavar='ROOT', multiple=True, type=click.Path(exists=True, file_okay=False, resolve_path=True),
+    help='also process directories below ROOT which already have venv-bootstrap.py or a file matching --marker, '
+         'skipping VCS, node_modules and venv directories'
+)
+@click.option('--marker', metavar='PATTERN', multiple=True, help='file name glob pattern marking a directory for --recursive')
 @click.argument('dir', nargs=-1, type=click.Path(exists=True, file_okay=False, resolve_path=True))
 def main(**args):
     """install venv-bootstrap.py script into specified directories"""
@@ -28,23 +61,410 @@ def main(**args):
         errors += 1
         click.secho("error: {}".format(msg), fg='red')
 
-    if not args["dir"]:
+    if not args["dir"] and not args["recursive"]:
         warn("no directories supplied")
 
     errors = 0
 
-    for i in args["dir"]:
-        installer = Installer(i)
+    decision_args = dict(
+        no_upgrade=args["no_upgrade"],
+        downgrade=args["downgrade"],
+        force=args["force"],
+        confirm_cb=None if args["no_interactive"] else lambda msg: click.confirm(msg),
+        info_cb=info,
+        warn_cb=warn,
+        error_cb=error
+    )
+
+    check_cache = None if args["no_cache"] else CheckCache()
+
+    # directories found by --recursive are processed as they are found, each only once, as
+    # concurrent installs into the same directory would race
+    dirs = _unique_dirs(itertools.chain(
+        args["dir"],
+        itertools.chain.from_iterable(find_targets(i, args["marker"], warn_cb=warn) for i in args["recursive"])
+    ))
+    installers = (Installer(i, check_cache) for i in dirs)
+
+    if args["jobs"] == 1:
+        for installer in installers:
+            installer.maybe_install(**decision_args)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        # files are checked and written in parallel, but decisions, and so all messages and
+        # prompts, are made one directory at a time, in order
+        window = args["jobs"] * 4
+        checks = collections.deque()
+        installs = collections.deque()
+
+        def decide():
+            installer, check = checks.popleft()
+            if installer.should_install(check_result=check.result(), **decision_args):
+                installs.append((installer, pool.submit(installer.install)))
+
+        def wait_install():
+            installer, install = installs.popleft()
+            try:
+                install.result()
+            except Exception as e:
+                error('failed to install into "{}": {}'.format(installer.path, e))
+
+        with ThreadPoolExecutor(args["jobs"]) as pool:
+            for installer in installers:
+                checks.append((installer, pool.submit(installer.check)))
+
+                if len(checks) >= window:
+                    decide()
+
+                if len(installs) >= window:
+                    wait_install()
+
+            while checks:
+                decide()
+
+            while installs:
+                wait_install()
+
+    if check_cache:
+        try:
+            check_cache.save()
+        except OSError as e:
+            warn('failed to save "{}": {}'.format(check_cache.fname, e))
+
+    if errors:
+        sys.exit(1)
+
+
+@click.command()
+@click.version_option()
+@click.option(
+    '--no-pip', is_flag=True, help='do not add "pip" and "setuptools" wheels used to install into venvs and build sdists'
+)
+@click.argument('wheelhouse', type=click.Path(file_okay=False, resolve_path=True))
+@click.argument('install')
+def wheelhouse(**args):
+    """fill WHEELHOUSE directory for "venv-bootstrap.py --wheelhouse" with wheels for INSTALL spec
+
+    INSTALL is parsed the same way as the "install" argument of venv-bootstrap.py. Wheels are built
+    for the python running this command, which should match the one used for bootstrapping.
+    """
+
+    import shlex
+    import subprocess
+
+    pip_args = ['wheel', '--wheel-dir', args["wheelhouse"]] + shlex.split(args["install"], posix=False)
+
+    if not args["no_pip"]:
+        pip_args += ['pip', 'setuptools']
+
+    sys.exit(subprocess.call([sys.executable, '-m', 'pip'] + pip_args))
+
+
+@click.command()
+@click.version_option()
+@click.option('--quiet', is_flag=True, help='omit info messages')
+@click.option('--dry-run', is_flag=True, help='only report what would be removed')
+@click.option(
+    '--cache-dir',
+    envvar='VENV_BOOTSTRAP_PY_CACHE',
+    type=click.Path(file_okay=False, resolve_path=True),
+    help='cache directory as passed to venv-bootstrap.py  [default: {}]'.format(default_cache_dir())
+)
+def prune_store(**args):
+    """remove entries of the "venv-bootstrap.py --store" package store not used by any venv"""
+
+    def info(msg):
+        if not args["quiet"]:
+            click.secho(msg)
+
+    removed = store.prune(
+        os.path.join(args["cache_dir"] or default_cache_dir(), 'store'),
+        dry_run=args["dry_run"],
+        info_cb=info
+    )
+    info('{} entries removed'.format(removed))
+
+
+def _parse_size(ctx, param, value):
+    try:
+        return None if value is None else venvs.parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _check_days(ctx, param, value):
+    # click 6 has no FloatRange
+    if value is not None and value < 0:
+        raise click.BadParameter('must not be negative')
+
+    return value
+
+
+@click.command()
+@click.version_option()
+@click.option('--quiet', is_flag=True, help='omit info messages')
+@click.option('--dry-run', is_flag=True, help='only report what would be removed')
+@click.option('--days', metavar='N', type=float, callback=_check_days, help='remove venvs not used for N days')
+@click.option(
+    '--max-size', metavar='SIZE', callback=_parse_size,
+    help='remove least recently used venvs while the total size exceeds SIZE, e.g. "10G"'
+)
+@click.argument('root', nargs=-1, required=True, type=click.Path(exists=True, file_okay=False, resolve_path=True))
+def gc(**args):
+    """remove venvs made by venv-bootstrap.py below ROOT which are unused for too long, or take too much space
+
+    Venvs are removed least recently used first, skipping those which are in use. Venvs made
+    by venv-bootstrap.py versions older than this one are not found.
+    """
+
+    if args["days"] is None and args["max_size"] is None:
+        raise click.UsageError('either --days or --max-size is required')
+
+    def info(msg):
+        if not args["quiet"]:
+            click.secho(msg)
+
+    def warn(msg):
+        click.secho("warning: {}".format(msg), fg='yellow')
+
+    removed, freed = venvs.collect(
+        args["root"],
+        max_age=None if args["days"] is None else args["days"] * 86400,
+        max_size=args["max_size"],
+        dry_run=args["dry_run"],
+        info_cb=info,
+        warn_cb=warn
+    )
+    info('{} venvs removed, {} freed'.format(removed, venvs.format_size(freed)))
+
+
+@click.group()
+@click.version_option()
+def snapshot():
+    """export venvs made by venv-bootstrap.py as relocatable archives and restore them, e.g. from a CI cache
+
+    Archives are named by a key derived from the interpreter ABI and platform, the install spec
+    and the version of venv-bootstrap.py, so that a directory of archives can be shared by
+    differing builds.
+    """
+
 
-        installer.maybe_install(
-            no_upgrade=args["no_upgrade"],
-            downgrade=args["downgrade"],
-            force=args["force"],
-            confirm_cb=None if args["no_interactive"] else lambda msg: click.confirm(msg),
+def _snapshot_key(args, interpreter):
+    from . import __version__
+
+    lock = None
+
+    if args["lock"]:
+        try:
+            with open(args["lock"]) as f:
+                lock = f.read()
+        except FileNotFoundError:
+            pass
+
+    return snapshots.snapshot_key(
+        interpreter,
+        __version__,
+        snapshots.install_fingerprint(args["install"], lock)
+    )
+
+
+def _snapshot_spec_options(f):
+    for option in reversed([
+        click.option('--install', required=True, help='install spec, as passed to venv-bootstrap.py'),
+        click.option(
+            '--lock', metavar='PATH', type=click.Path(dir_okay=False),
+            help='lock file of "venv-bootstrap.py --lock" (venv-bootstrap.<module>.lock), if used'
+        ),
+        click.option(
+            '--python', metavar='PATH', default=sys.executable,
+            help='python running venv-bootstrap.py  [default: the one running this command]'
+        ),
+    ]):
+        f = option(f)
+
+    return f
+
+
+@snapshot.command()
+@_snapshot_spec_options
+def key(**args):
+    """print the key of archives of venvs bootstrapped with the given install spec"""
+
+    try:
+        click.echo(_snapshot_key(args, snapshots.query_interpreter(args["python"])))
+    except snapshots.SnapshotError as e:
+        raise click.ClickException(str(e))
+
+
+@snapshot.command('export')
+@click.option('--quiet', is_flag=True, help='omit info messages')
+@click.argument('venv', type=click.Path(exists=True, file_okay=False, resolve_path=True))
+@click.argument('dir', type=click.Path(file_okay=False, resolve_path=True))
+def snapshot_export(**args):
+    """write an archive of VENV into DIR, replacing one with the same key"""
+
+    try:
+        fname = snapshots.export(args["venv"], args["dir"])
+    except snapshots.SnapshotError as e:
+        raise click.ClickException(str(e))
+
+    if not args["quiet"]:
+        click.secho('exported "{}" as "{}"'.format(args["venv"], fname))
+
+
+@snapshot.command('import')
+@click.option('--quiet', is_flag=True, help='omit info messages')
+@_snapshot_spec_options
+@click.argument('dir', type=click.Path(file_okay=False, resolve_path=True))
+@click.argument('venv', type=click.Path(resolve_path=True))
+def snapshot_import(**args):
+    """restore VENV from the archive in DIR matching the given install spec
+
+    Exits with code 1, leaving VENV alone, if there is no such archive, so that venv-bootstrap.py
+    makes it as usual.
+    """
+
+    def info(msg):
+        if not args["quiet"]:
+            click.secho(msg)
+
+    start = time.time()
+
+    try:
+        interpreter = snapshots.query_interpreter(args["python"])
+        fname = os.path.join(args["dir"], snapshots.archive_name(_snapshot_key(args, interpreter)))
+
+        if not os.path.exists(fname):
+            info('no archive for this install spec in "{}"'.format(args["dir"]))
+            sys.exit(1)
+
+        snapshots.restore(fname, args["venv"], interpreter)
+    except snapshots.SnapshotError as e:
+        raise click.ClickException(str(e))
+
+    info('restored "{}" from "{}" in {:.2f}s'.format(args["venv"], fname, time.time() - start))
+
+
+@click.command()
+@click.version_option()
+@click.option('--quiet', is_flag=True, help='omit info messages')
+@click.option(
+    '--script', metavar='PATH', default=SCRIPT_FNAME, show_default=True, type=click.Path(exists=True, dir_okay=False),
+    help='venv-bootstrap.py to make venvs with'
+)
+@click.option(
+    '--jobs', default=4, metavar='N', type=click.IntRange(1), show_default=True,
+    help='number of venvs to make in parallel'
+)
+@click.option(
+    '--python', metavar='PATH', default=sys.executable,
+    help='python to run venv-bootstrap.py with  [default: the one running this command]'
+)
+@click.option(
+    '--script-arg', metavar='ARG', multiple=True,
+    help='extra option to pass to venv-bootstrap.py, e.g. --script-arg=--template'
+)
+@click.argument('entries', type=click.Path(exists=True, dir_okay=False))
+def prepare(**args):
+    """make and install venvs listed in ENTRIES with venv-bootstrap.py in parallel, without running any module
+
+    ENTRIES is a JSON file with a list of objects with "module", "install" and "venv" keys, the
+    latter two being optional, standing for "venv-bootstrap.py [--venv VENV] MODULE INSTALL".
+    Exits with code 1 if any of the venvs failed.
+    """
+
+    from . import prepare as prepare_
+
+    def info(msg):
+        if not args["quiet"]:
+            click.secho(msg)
+
+    try:
+        entries = prepare_.read_entries(args["entries"])
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='ENTRIES')
+
+    failed = 0
+
+    for result in prepare_.prepare(
+        args["script"],
+        entries,
+        python=args["python"],
+        script_args=args["script_arg"],
+        jobs=args["jobs"]
+    ):
+        if result.ok:
+            info('ok      {:7.2f}s  {}'.format(result.elapsed, result.entry))
+        else:
+            failed += 1
+            click.secho('failed  {:7.2f}s  {}'.format(result.elapsed, result.entry), fg='red')
+            click.echo(''.join('    ' + i for i in result.output.rstrip('\n').splitlines(True)))
+
+    info('{} venvs prepared, {} failed'.format(len(entries) - failed, failed))
+
+    if failed:
+        sys.exit(1)
+
+
+@click.command()
+@click.version_option()
+@click.option('--quiet', is_flag=True, help='omit info messages')
+@click.option(
+    '--jobs', default=os.cpu_count() or 1, metavar='N', type=click.IntRange(1), show_default=True,
+    help='number of files to check in parallel'
+)
+@click.option('--repair', is_flag=True, help='reinstall broken distributions with "pip install --force-reinstall --no-deps"')
+@click.option(
+    '--wheelhouse', metavar='PATH', envvar='VENV_BOOTSTRAP_PY_WHEELHOUSE', type=click.Path(file_okay=False, resolve_path=True),
+    help='reinstall from wheels in the local directory only, as with "venv-bootstrap.py --wheelhouse"'
+)
+@click.option(
+    '--cache-dir',
+    envvar='VENV_BOOTSTRAP_PY_CACHE',
+    type=click.Path(file_okay=False, resolve_path=True),
+    help='cache directory as passed to venv-bootstrap.py, to take pip from for venvs without it  '
+         '[default: {}]'.format(default_cache_dir())
+)
+@click.argument('venv', nargs=-1, required=True, type=click.Path(exists=True, file_okay=False, resolve_path=True))
+def verify(**args):
+    """check files of distributions installed into each VENV against sizes and hashes recorded by pip
+
+    Exits with code 1 if any distribution is broken, unless it gets repaired.
+    """
+
+    from . import verify as verify_
+
+    def info(msg):
+        if not args["quiet"]:
+            click.secho(msg)
+
+    def error(msg):
+        click.secho("error: {}".format(msg), fg='red')
+
+    failed = False
+
+    for venv in args["venv"]:
+        start = time.time()
+        checked, problems = verify_.verify(venv, jobs=args["jobs"])
+
+        for problem in problems:
+            click.secho('broken: {}'.format(problem), fg='red')
+
+        dist_infos = set(i.dist_info for i in problems)
+        info('"{}": {} files checked in {:.2f}s, {} broken distributions'.format(
+            venv, checked, time.time() - start, len(dist_infos)
+        ))
+
+        if dist_infos and not (args["repair"] and verify_.repair(
+            venv,
+            dist_infos,
+            cache_dir=args["cache_dir"] or default_cache_dir(),
+            wheelhouse=args["wheelhouse"],
             info_cb=info,
-            warn_cb=warn,
             error_cb=error
-        )
+        )):
+            failed = True
 
-    if errors:
+    if failed:
         sys.exit(1)
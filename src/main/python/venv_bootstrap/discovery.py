@@ -0,0 +1,89 @@
+import fnmatch
+import os
+from .installer import SCRIPT_FNAME
+
+IGNORED_DIRS = {'.git', '.hg', '.svn', '.tox', '.nox', 'node_modules', '__pycache__'}
+
+
+def _nop_msg_cb(msg):
+    pass
+
+
+def is_ignored_dir(name):
+    # venvs made by venv-bootstrap.py are named ".venv.<module>" by default
+    return name in IGNORED_DIRS or name.startswith('.venv.')
+
+
+def _read_dir(path):
+    """return (directory names, other names) of entries of path, not following symlinks"""
+
+    dirs = []
+    files = []
+
+    if not hasattr(os, 'scandir'):
+        # Python 3.4
+        import stat
+
+        for name in os.listdir(path):
+            try:
+                is_dir = stat.S_ISDIR(os.lstat(os.path.join(path, name)).st_mode)
+            except OSError:
+                is_dir = False
+
+            (dirs if is_dir else files).append(name)
+
+        return dirs, files
+
+    it = os.scandir(path)
+
+    try:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+
+            (dirs if is_dir else files).append(entry.name)
+    finally:
+        # the iterator is only a context manager as of Python 3.6
+        if hasattr(it, 'close'):
+            it.close()
+
+    return dirs, files
+
+
+def walk(root, *, ignore=is_ignored_dir, prune=None, warn_cb=_nop_msg_cb):
+    """yield (path, file names) for root and all directories below it, depth first, in sorted order
+
+    Directories are read one at a time (with os.scandir, where available), so memory use does not depend on the
+    size of the tree. Symlinked directories are not followed, nor are directories for which
+    prune(path, file names) is true.
+    """
+
+    stack = [root]
+
+    while stack:
+        path = stack.pop()
+
+        try:
+            dirs, files = _read_dir(path)
+        except OSError as e:
+            warn_cb('cannot read directory "{}": {}'.format(path, e))
+            continue
+
+        dirs = [i for i in dirs if not ignore(i)]
+
+        yield path, files
+
+        if prune and prune(path, files):
+            continue
+
+        stack.extend(os.path.join(path, i) for i in sorted(dirs, reverse=True))
+
+
+def find_targets(root, markers=(), **kwargs):
+    """yield directories below root which have venv-bootstrap.py or a file matching any of markers"""
+
+    for path, files in walk(root, **kwargs):
+        if any(i == SCRIPT_FNAME or any(fnmatch.fnmatch(i, j) for j in markers) for i in files):
+            yield path
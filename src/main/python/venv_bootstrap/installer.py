@@ -1,55 +1,170 @@
 import os
-import pkg_resources
 import re
-from atomicwrites import atomic_write
-from . import __version__
+import stat
+import time
+from .cache import default_cache_dir
+from .version import InvalidVersion, parse_version
+
+# note: heavier modules, and even __version__ (which may need setuptools_scm when running from sources),
+# are only imported when needed, as this module is used by venv-bootstrap-install, which may be run
+# from git hooks and such
 
 SCRIPT_UUID = b"2ca11a4f-5d89-4cc9-bb4c-f50f65c62119"
 SCRIPT_FNAME = "venv-bootstrap.py"
-VERSION = pkg_resources.parse_version(__version__)
 MAX_READ = 1000000
+# both "VERSION = ..." and the UUID are expected to be found within this many bytes
+HEADER_READ = 4096
+# check results which depend only on file contents
+CACHEABLE_RESULTS = {
+    'not-our', 'version-unknown', 'version-newer', 'version-older', 'version-same', 'version-same-modified'
+}
+# files modified less than this many seconds ago may get modified again without mtime changing
+RACY_MTIME_WINDOW = 2
 
 
 def _nop_msg_cb(msg):
     pass
 
 
+def get_version():
+    """return the parsed version of venv-bootstrap.py installed by this package"""
+
+    global _version
+
+    if _version is None:
+        from . import __version__
+        _version = parse_version(__version__)
+
+    return _version
+
+
+_version = None
+
+
+class CheckCache:
+    """persistent map of (device, inode, size, mtime) of existing files to Installer.check() results
+
+    Entries of files which are gone or changed are dropped on save, so that files in removed
+    directories, such as temporary ones, do not pile up.
+    """
+
+    def __init__(self, fname=None):
+        import json
+        from . import __version__
+
+        self.fname = fname or os.path.join(default_cache_dir(), 'check-cache.json')
+        self._dirty = False
+
+        try:
+            with open(self.fname) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        # results depend on the version being installed
+        entries = data.get('entries', {}) if data.get('version') == __version__ else {}
+        # {key: [result, file name]}
+        self._entries = {k: v for k, v in entries.items() if isinstance(v, list) and len(v) == 2}
+
+    @staticmethod
+    def _key(st):
+        return '{}:{}:{}:{}'.format(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, st):
+        entry = self._entries.get(self._key(st))
+        return entry and entry[0]
+
+    def put(self, fname, st, result):
+        if result in CACHEABLE_RESULTS and time.time() - st.st_mtime > RACY_MTIME_WINDOW:
+            self._entries[self._key(st)] = [result, os.path.abspath(fname)]
+            self._dirty = True
+
+    def _is_current(self, key, fname):
+        try:
+            return self._key(os.lstat(fname)) == key
+        except OSError:
+            return False
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        import json
+        from atomicwrites import atomic_write
+        from . import __version__
+
+        self._entries = {k: v for k, v in self._entries.items() if self._is_current(k, v[1])}
+
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        with atomic_write(self.fname, overwrite=True) as f:
+            json.dump({'version': __version__, 'entries': self._entries}, f)
+
+        self._dirty = False
+
+
 class Installer:
     _script = None
 
-    def __init__(self, path):
+    def __init__(self, path, check_cache=None):
         self.path = path
         self.fname = os.path.join(path, SCRIPT_FNAME)
+        self.check_cache = check_cache
 
     @classmethod
     def get_script(cls):
         if cls._script is None:
-            cls._script = \
-                pkg_resources.resource_string(__name__, 'res/' + SCRIPT_FNAME) \
+            from . import __version__
+
+            try:
+                from importlib.resources import files
+            except ImportError:
+                from pkgutil import get_data
+                script = get_data(__package__, 'res/' + SCRIPT_FNAME)
+            else:
+                script = files(__package__).joinpath('res').joinpath(SCRIPT_FNAME).read_bytes()
+
+            cls._script = script \
                 .replace(b'@@@VERSION@@@', __version__.encode()) \
                 .replace(b'@@@UUID@@@', SCRIPT_UUID)
 
         return cls._script
 
     def check(self):
-        if not os.path.isdir(self.path):
-            return 'no-dir'
+        try:
+            st = os.lstat(self.fname)
+        except OSError:
+            return 'absent' if os.path.isdir(self.path) else 'no-dir'
 
-        if os.path.isdir(self.fname):
+        if stat.S_ISDIR(st.st_mode):
             return 'a-dir'
 
-        if not os.path.lexists(self.fname):
-            return 'absent'
-
-        if os.path.islink(self.fname):
+        if stat.S_ISLNK(st.st_mode):
             return 'a-link'
 
+        result = self.check_cache and self.check_cache.get(st)
+
+        if result is None:
+            result = self._check_contents(st)
+
+            if self.check_cache:
+                self.check_cache.put(self.fname, st, result)
+
+        return result
+
+    def _check_contents(self, st):
         try:
             with open(self.fname, 'rb') as f:
-                contents = f.read(MAX_READ)
-        except: # noqa
+                return self._check_file(f, st)
+        except OSError:
             return 'read-error'
 
+    def _check_file(self, f, st):
+        # most files are classified by their header alone
+        contents = f.read(HEADER_READ)
+
+        if len(contents) == HEADER_READ and (SCRIPT_UUID not in contents or b'\nVERSION = ' not in contents):
+            contents += f.read(MAX_READ - len(contents))
+
         if SCRIPT_UUID not in contents:
             return 'not-our'
 
@@ -58,22 +173,29 @@ class Installer:
         if len(version_strs) != 1:
             return 'version-unknown'
 
-        version = pkg_resources.parse_version(version_strs[0].decode(errors='ignore'))
+        try:
+            version = parse_version(version_strs[0].decode(errors='ignore'))
+        except InvalidVersion:
+            return 'version-unknown'
 
-        if version > VERSION:
+        if version > get_version():
             return 'version-newer'
 
-        if version < VERSION:
+        if version < get_version():
             return 'version-older'
 
         self.get_script()
 
-        if contents == self._script:
+        if st.st_size == len(self._script) and contents + f.read(MAX_READ - len(contents)) == self._script:
             return 'version-same'
 
         return 'version-same-modified'
 
-    def maybe_install(
+    def maybe_install(self, **kwargs):
+        if self.should_install(**kwargs):
+            self.install()
+
+    def should_install(
         self,
         *,
         check_result=None,
@@ -154,9 +276,10 @@ class Installer:
 
         decision = should_install()
         assert decision is not None
-        if decision:
-            self.install()
+        return decision
 
     def install(self):
+        from atomicwrites import atomic_write
+
         with atomic_write(self.fname, mode='wb', overwrite=True) as f:
             f.write(self.get_script())
@@ -0,0 +1,98 @@
+import os
+import time
+
+
+class Entry:
+    """a venv to be made by "venv-bootstrap.py --prepare-only" """
+
+    def __init__(self, module, install='', venv=None):
+        self.module = module
+        self.install = install
+        self.venv = venv
+
+    def __str__(self):
+        return self.module if self.venv is None else '{} ({})'.format(self.module, self.venv)
+
+
+class Result:
+    def __init__(self, entry, returncode, elapsed, output):
+        self.entry = entry
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.output = output
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+def read_entries(fname):
+    """read a JSON list of {"module": ..., "install": ..., "venv": ...} objects, raising ValueError if malformed
+
+    "install" may be omitted for modules listed in venv-bootstrap.json, and "venv" to use the
+    default venv of venv-bootstrap.py.
+    """
+
+    import json
+
+    with open(fname) as f:
+        data = json.load(f)
+
+    if not isinstance(data, list):
+        raise ValueError('a list of entries expected')
+
+    entries = []
+
+    for i in data:
+        if not isinstance(i, dict) or not isinstance(i.get('module'), str) or not all(
+            isinstance(i.get(k, ''), str) for k in ['install', 'venv']
+        ):
+            raise ValueError('entry {} must have "module" string and optional "install" and "venv" strings'.format(i))
+
+        entries.append(Entry(i['module'], i.get('install', ''), i.get('venv')))
+
+    return entries
+
+
+def prepare_one(script, entry, *, python, script_args=()):
+    import subprocess
+
+    command = [python, script, '--prepare-only'] + list(script_args)
+
+    if entry.venv is not None:
+        command += ['--venv', entry.venv]
+
+    start = time.time()
+    process = subprocess.Popen(
+        command + [entry.module, entry.install],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True
+    )
+
+    with process:
+        output = process.communicate()[0]
+
+    return Result(entry, process.returncode, time.time() - start, output)
+
+
+def prepare(script, entries, *, python, script_args=(), jobs=1):
+    """run "venv-bootstrap.py --prepare-only" for each entry, up to jobs at a time, yielding results as they come
+
+    Entries sharing a venv are serialized by venv-bootstrap.py itself, while pip runs of all
+    entries share the pip cache, as well as the cache directory of venv-bootstrap.py.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    script = os.path.abspath(script)
+
+    with ThreadPoolExecutor(jobs) as pool:
+        futures = [
+            pool.submit(prepare_one, script, entry, python=python, script_args=script_args)
+            for entry in entries
+        ]
+
+        for future in as_completed(futures):
+            yield future.result()
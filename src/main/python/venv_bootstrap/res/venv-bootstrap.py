@@ -44,6 +44,10 @@ VERSION = "@@@VERSION@@@"
 # @@@UUID@@@
 
 import sys
+import time
+
+# taken as early as possible, see "--timing"
+start_time = time.time()
 
 if sys.version_info < (3, 4):
     sys.exit("Sorry, venv-bootstrap.py requires at least Python 3.4")
@@ -51,22 +55,1192 @@ if sys.version_info < (3, 4):
 import argparse
 import contextlib
 import os
+import re
 import runpy
 import signal
-import subprocess
-import venv
 
+# keep in sync with venv_bootstrap/cache.py
+STAMP_FNAME = 'venv-bootstrap.stamp'
+FINGERPRINT_FNAME = 'venv-bootstrap.install'
+TEMPLATE_FNAME = 'venv-bootstrap.template'
+LOCK_FNAME = 'venv-bootstrap.lock'
+BUNDLE_FNAME = 'venv-bootstrap.bundle.zip'
+MANIFEST_FNAME = 'venv-bootstrap.json'
+USED_FNAME = 'venv-bootstrap.used'
+INUSE_FNAME = 'venv-bootstrap.inuse'
+LAUNCH_FNAME = 'venv-bootstrap.launch'
+# USED_FNAME is touched at most this often (see "venv-bootstrap-gc")
+USED_INTERVAL = 3600
+# pip to download when first caching it, unless the one bundled with "ensurepip" is newer, so that
+# bootstraps are reproducible: the last release supporting each Python version, or a recent one
+PIP_VERSIONS = {(3, 4): '19.1.1', (3, 5): '20.3.4', (3, 6): '21.3.1', (3, 7): '24.0', (3, 8): '25.0.1'}
+PIP_VERSION = '25.1.1'
+# sun_path of unix sockets holds this many bytes on macOS and BSDs (108 on Linux), the terminating null included
+MAX_SOCKET_PATH = 104
+
+
+def read_file(fname):
+    try:
+        with open(fname) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_file(fname, contents, mode=None):
+    # atomic with regard to concurrent readers
+    tmp_fname = '{}.{}.tmp'.format(fname, os.getpid())
+
+    with open(tmp_fname, 'w') as f:
+        f.write(contents)
+
+    if mode is not None:
+        os.chmod(tmp_fname, mode)
+
+    os.replace(tmp_fname, fname)
+
+
+def interpreter_stamp():
+    # everything that makes an existing venv unusable when changed
+    if hasattr(os, 'uname'):
+        machine = os.uname().machine
+    else:
+        machine = os.environ.get('PROCESSOR_ARCHITECTURE', '')
+
+    return ''.join('{} {}\n'.format(k, v) for k, v in [
+        ('bootstrap', VERSION),
+        ('executable', sys.executable),
+        ('version', sys.version.replace('\n', ' ')),
+        ('abi', sys.implementation.cache_tag + getattr(sys, 'abiflags', '')),
+        ('platform', sys.platform + '-' + machine),
+    ])
+
+
+def read_stamp(venv_dir):
+    """return env_exe recorded in a venv stamp matching the current interpreter, or None"""
+
+    stamp = read_file(os.path.join(venv_dir, STAMP_FNAME))
+    expected = interpreter_stamp()
+
+    if stamp is None or not stamp.startswith(expected):
+        return None
+
+    key, _, env_exe = stamp[len(expected):].rstrip('\n').partition(' ')
+
+    if key != 'env_exe' or not os.path.exists(env_exe):
+        return None
+
+    return env_exe
+
+
+def write_stamp(venv_dir, env_exe):
+    write_file(os.path.join(venv_dir, STAMP_FNAME), interpreter_stamp() + 'env_exe {}\n'.format(env_exe))
+
+
+def create_venv(venv_dir):
+    """(re)create a venv and return the path of its python executable"""
+
+    import venv
+
+    class EnvBuilder(venv.EnvBuilder):
+        def ensure_directories(self, env_dir):
+            self.last_context = super().ensure_directories(env_dir)
+            return self.last_context
+
+        def setup_scripts(self, context):
+            pass
+
+    # whatever was installed for another interpreter cannot be trusted
+    for i in [FINGERPRINT_FNAME, LAUNCH_FNAME]:
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(venv_dir, i))
+
+    builder = EnvBuilder(symlinks=os.name != 'nt')
+    builder.create(venv_dir)
+    write_stamp(venv_dir, builder.last_context.env_exe)
+
+    return builder.last_context.env_exe
+
+
+def mark_used(venv_dir):
+    """record the time venv_dir was last used, at most once per USED_INTERVAL to keep launches free of writes"""
+
+    fname = os.path.join(venv_dir, USED_FNAME)
+
+    try:
+        try:
+            if time.time() - os.stat(fname).st_mtime < USED_INTERVAL:
+                return
+
+            os.utime(fname)
+        except FileNotFoundError:
+            open(fname, 'a').close()
+    except OSError:
+        pass
+
+
+def hold_in_use(venv_dir, wait=True):
+    """hold a shared lock on venv_dir for the lifetime of this process, exec included (POSIX only)
+
+    Waits while "venv-bootstrap-gc" removes the venv, in which case, as well as if venv_dir is
+    gone already, returns False. Unless wait, returns False right away instead of waiting.
+    """
+
+    if os.name != 'posix':
+        return True
+
+    import fcntl
+
+    fname = os.path.join(venv_dir, INUSE_FNAME)
+
+    try:
+        fd = os.open(fname, os.O_RDONLY | os.O_CREAT, 0o666)
+    except OSError:
+        return False
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | (0 if wait else fcntl.LOCK_NB))
+    except OSError:
+        os.close(fd)
+        return False
+
+    try:
+        # the venv is moved away before being removed
+        same = os.path.samestat(os.fstat(fd), os.stat(fname))
+    except OSError:
+        same = False
+
+    if not same:
+        os.close(fd)
+        return False
+
+    os.set_inheritable(fd, True)
+    return True
+
+
+def try_lock(f):
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+
+    return True
+
+
+@contextlib.contextmanager
+def venv_lock(venv_dir, timeout, fail_code, timing):
+    """hold an exclusive advisory lock on a venv while it is being created or installed into
+
+    The lock is released when the process exits or execs, as the file descriptor is not inheritable.
+    """
+
+    os.makedirs(venv_dir, exist_ok=True)
+    deadline = time.monotonic() + timeout
+
+    with open(os.path.join(venv_dir, LOCK_FNAME), 'ab') as f:
+        with timing.phase('lock_wait'):
+            while not try_lock(f):
+                if time.monotonic() > deadline:
+                    sys.stderr.write('error: timed out waiting for a concurrent bootstrap of "{}"\n'.format(venv_dir))
+                    timing.write(failed=True)
+                    sys.exit(fail_code)
+
+                time.sleep(0.1)
+
+        yield
+
+
+def text_digest(text):
+    import hashlib
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def install_fingerprint(install_args):
+    return 'spec {}\n'.format(text_digest('\n'.join(install_args)))
+
+
+REQUIREMENT_RE = r'^([A-Za-z0-9][A-Za-z0-9._-]*)((?:\s*(?:===|==|!=|~=|<=|>=|<|>)\s*[^,\s]+\s*,?)*)$'
+SPECIFIER_RE = r'(===|==|!=|~=|<=|>=|<|>)\s*([^,\s]+)'
+VERSION_RE = (
+    r'^v?(\d+(?:\.\d+)*)'
+    r'(?:[-_.]?(a|b|c|rc|alpha|beta|pre|preview)[-_.]?(\d*))?'
+    r'(?:-(\d+)|[-_.]?(?:post|rev|r)[-_.]?(\d*))?'
+    r'(?:[-_.]?dev[-_.]?(\d*))?$'
+)
+PRE_RELEASE_RANKS = {'a': 0, 'alpha': 0, 'b': 1, 'beta': 1, 'c': 2, 'rc': 2, 'pre': 2, 'preview': 2}
+
+
+def version_key(version):
+    """return a comparison key for a public PEP 440 version, or None if it cannot be parsed"""
+
+    m = re.match(VERSION_RE, version.strip(), re.IGNORECASE)
+    if not m:
+        return None
+
+    release, pre, pre_n, post_implicit, post_n, dev_n = m.groups()
+    release = [int(i) for i in release.split('.')]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+
+    is_post = post_implicit is not None or post_n is not None
+    is_dev = dev_n is not None
+
+    if pre:
+        pre_key = (0, PRE_RELEASE_RANKS[pre.lower()], int(pre_n or 0))
+    elif is_dev and not is_post:
+        pre_key = (-1,)
+    else:
+        pre_key = (1,)
+
+    return (
+        tuple(release),
+        pre_key,
+        (0, int(post_implicit or post_n or 0)) if is_post else (-1,),
+        (0, int(dev_n or 0)) if is_dev else (1,),
+        bool(pre) or is_dev
+    )
+
+
+def version_satisfies(version, op, spec_version):
+    """check a single version specifier, returning None if it cannot be decided here"""
+
+    if op == '===':
+        return version == spec_version
+
+    key = version_key(version)
+    spec_key = version_key(spec_version)
+
+    # pre-releases, wildcards and local versions are left to pip
+    if key is None or spec_key is None or key[-1] or spec_key[-1]:
+        return None
+
+    key = key[:-1]
+    spec_key = spec_key[:-1]
+
+    if op == '~=':
+        # the prefix is taken as written, e.g. "~=1.4.0" is "==1.4.*", while trailing zeros are stripped from keys
+        prefix = tuple(int(i) for i in re.match(VERSION_RE, spec_version.strip(), re.IGNORECASE).group(1).split('.')[:-1])
+        if not prefix:
+            return None
+        release = key[0] + (0,) * len(prefix)
+        return key >= spec_key and release[:len(prefix)] == prefix
+
+    if op == '>' and key[:2] == spec_key[:2] and spec_key[2] == (-1,):
+        # post-releases of the given version are excluded by ">"
+        return False
+
+    return {
+        '==': key == spec_key,
+        '!=': key != spec_key,
+        '<=': key <= spec_key,
+        '>=': key >= spec_key,
+        '<': key < spec_key,
+        '>': key > spec_key,
+    }[op]
+
+
+def unsatisfied_requirements(install_args, path):
+    """return the part of "pip install" arguments not satisfied by distributions installed in path
+
+    Only plain "name" and "name<specifiers>" requirements are checked, using distribution metadata,
+    so this does not need to import pip. Anything else (paths, URLs, extras, markers) is always
+    considered unsatisfied, and any options make all arguments to be handed over to pip.
+    """
+
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        return install_args
+
+    if any(i.startswith('-') for i in install_args):
+        return install_args
+
+    result = []
+
+    for i in install_args:
+        m = re.match(REQUIREMENT_RE, i)
+        version = None
+
+        if m:
+            # not from all of sys.path, which starts with the directory of this script
+            for dist in metadata.distributions(name=m.group(1), path=path):
+                version = dist.version
+                break
+
+        if version is None or not all(
+            version_satisfies(version, op, spec_version)
+            for op, spec_version in re.findall(SPECIFIER_RE, m.group(2))
+        ):
+            result.append(i)
+
+    return result
+
+
+def make_lock(report_fname, fingerprint):
+    """turn a "pip install --report" into hash-pinned requirements, or return None if some can't be pinned"""
+
+    import hashlib
+    import json
+    import urllib.parse
+    import urllib.request
+
+    with open(report_fname) as f:
+        report = json.load(f)
+
+    lines = ['# generated by venv-bootstrap.py, do not edit\n', '# ' + fingerprint]
+
+    for i in sorted(report['install'], key=lambda i: i['metadata']['name'].lower()):
+        archive_info = i['download_info'].get('archive_info')
+
+        if archive_info is None:
+            # a directory or VCS checkout
+            return None
+
+        hashes = dict(archive_info.get('hashes', {}))
+        if 'hash' in archive_info:
+            name, _, value = archive_info['hash'].partition('=')
+            hashes.setdefault(name, value)
+
+        sha256 = hashes.get('sha256')
+
+        if not sha256:
+            url = urllib.parse.urlparse(i['download_info']['url'])
+            if url.scheme != 'file':
+                return None
+
+            with open(urllib.request.url2pathname(url.path), 'rb') as f:
+                sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        lines.append('{}=={} --hash=sha256:{}\n'.format(i['metadata']['name'], i['metadata']['version'], sha256))
+
+    return ''.join(lines)
+
+
+def default_cache_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(base, 'venv-bootstrap.py')
+
+
+def share_file(src, dst):
+    """make dst have the same contents as src, sharing storage with it where the filesystem allows"""
+
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+
+    import shutil
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            # reflinks or server-side copies, where supported
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                pass
+        except (AttributeError, OSError):
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst)
+
+    shutil.copystat(src, dst)
 
-class EnvBuilder(venv.EnvBuilder):
-    def ensure_directories(self, env_dir):
-        self.last_context = super().ensure_directories(env_dir)
-        return self.last_context
 
-    def setup_scripts(self, context):
+def clone_venv(src_dir, dst_dir, dst_location=None):
+    """copy a venv sharing file contents, only rewriting files referring to the venv by absolute path
+
+    dst_location is where the copy is going to be moved to, if not dst_dir.
+    """
+
+    src_prefix = os.path.abspath(src_dir).encode()
+    dst_prefix = os.path.abspath(dst_location or dst_dir).encode()
+
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        dst_root = os.path.normpath(os.path.join(dst_dir, rel_root))
+        os.makedirs(dst_root, exist_ok=True)
+
+        # venv scripts and our own files are the only ones that may embed the venv location
+        may_refer_to_venv = rel_root in ['.', 'bin', 'Scripts']
+
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_root, name)
+
+            if rel_root == '.' and name in [TEMPLATE_FNAME, LOCK_FNAME, BUNDLE_FNAME, USED_FNAME, INUSE_FNAME, LAUNCH_FNAME]:
+                continue
+
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif name in files:
+                contents = None
+
+                if may_refer_to_venv and os.path.getsize(src) < 1000000:
+                    with open(src, 'rb') as f:
+                        contents = f.read()
+
+                if contents and src_prefix in contents:
+                    with open(dst, 'wb') as f:
+                        f.write(contents.replace(src_prefix, dst_prefix))
+                    os.chmod(dst, os.stat(src).st_mode)
+                else:
+                    share_file(src, dst)
+
+        # os.walk would not descend into symlinked directories anyway
+        dirs[:] = [i for i in dirs if not os.path.islink(os.path.join(root, i))]
+
+
+def template_dir(cache_dir, identity, install_args):
+    key = text_digest(identity + install_fingerprint(install_args))
+    return os.path.join(cache_dir, 'templates', key[:32])
+
+
+def clone_template(template, venv_dir):
+    """clone a template as venv_dir, which must have nothing but lock files in it
+
+    The clone is made next to venv_dir and moved into it with the fingerprint and the stamp last, so
+    that a partial clone, even if interrupted, is never taken for a venv created by this interpreter.
+    """
+
+    import shutil
+
+    tmp_venv = '{}.{}.tmp'.format(os.path.abspath(venv_dir), os.getpid())
+
+    try:
+        clone_venv(template, tmp_venv, venv_dir)
+
+        for name in sorted(os.listdir(tmp_venv), key=lambda i: (i == STAMP_FNAME, i == FINGERPRINT_FNAME)):
+            os.replace(os.path.join(tmp_venv, name), os.path.join(venv_dir, name))
+    finally:
+        shutil.rmtree(tmp_venv, ignore_errors=True)
+
+
+def seed_template(venv_dir, template):
+    """publish a copy of a freshly installed venv as a template, unless one already exists"""
+
+    import shutil
+
+    tmp_template = '{}.{}.tmp'.format(template, os.getpid())
+
+    try:
+        clone_venv(venv_dir, tmp_template, template)
+        write_file(os.path.join(tmp_template, TEMPLATE_FNAME), '')
+        os.makedirs(os.path.dirname(template), exist_ok=True)
+        os.rename(tmp_template, template)
+    except OSError:
+        # most likely, a concurrent bootstrap got there first
+        shutil.rmtree(tmp_template, ignore_errors=True)
+
+
+def store_site_packages(store, site_packages):
+    """replace installed distribution files with hardlinks into a content-addressed store
+
+    This is done after pip has installed the files, so it saves disk space, but not installation I/O.
+    Store entries are keyed by file hashes from RECORD, which pip writes for every installed wheel.
+    Each venv using an entry is registered in its "refs" directory, for the store to be pruned safely.
+    """
+
+    import csv
+    import glob
+    import shutil
+
+    for dist_info in glob.glob(os.path.join(os.path.abspath(site_packages), '*.dist-info')):
+        try:
+            with open(os.path.join(dist_info, 'RECORD'), newline='') as f:
+                # files outside of site-packages, e.g. scripts, have venv specific contents
+                record = [i for i in csv.reader(f) if len(i) == 3 and i[1] and not i[0].startswith('..')]
+        except OSError:
+            continue
+
+        key = text_digest('\n'.join([os.path.basename(dist_info)] + sorted(','.join(i) for i in record)))
+        entry = os.path.join(store, key[:32])
+        files = os.path.join(entry, 'files')
+
+        refs = os.path.join(entry, 'refs')
+        os.makedirs(refs, exist_ok=True)
+        write_file(os.path.join(refs, text_digest(dist_info)[:32]), dist_info)
+
+        if not os.path.isdir(files):
+            tmp_files = '{}.{}.tmp'.format(files, os.getpid())
+
+            try:
+                for path, _, _ in record:
+                    dst = os.path.join(tmp_files, path)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    share_file(os.path.join(site_packages, path), dst)
+
+                os.rename(tmp_files, files)
+            except OSError:
+                shutil.rmtree(tmp_files, ignore_errors=True)
+
+        for path, _, size in record:
+            src = os.path.join(files, path)
+            dst = os.path.join(site_packages, path)
+
+            try:
+                if os.path.samefile(src, dst) or os.path.getsize(src) != int(size):
+                    continue
+
+                tmp_dst = '{}.{}.tmp'.format(dst, os.getpid())
+                os.link(src, tmp_dst)
+                os.replace(tmp_dst, dst)
+            except (OSError, ValueError):
+                # e.g. the store is on another filesystem
+                pass
+
+
+# needed on disk to manage the venv itself
+BUNDLE_EXCLUDED = {'pip', 'setuptools', 'pkg_resources', 'wheel', '_distutils_hack'}
+# files which are not needed at runtime, and so do not prevent bundling (PEP 561)
+BUNDLE_IGNORED_RE = r'.*\.pyi$|^py\.typed$'
+
+
+def bundle_candidates(site_packages):
+    """yield names of top-level modules and packages in site_packages which consist of python sources only"""
+
+    excluded = set(BUNDLE_EXCLUDED)
+
+    # modules imported by .pth files are imported by "site" before the bundle is on sys.path
+    for name in os.listdir(site_packages):
+        if name.endswith('.pth'):
+            excluded.update(
+                i.split('.')[0]
+                for i in re.findall(r'^import\s+([\w.]+)', read_file(os.path.join(site_packages, name)) or '', re.MULTILINE)
+            )
+
+    for name in sorted(os.listdir(site_packages)):
+        path = os.path.join(site_packages, name)
+
+        if name.endswith('.py') and os.path.isfile(path):
+            if name[:-3] not in excluded:
+                yield name
+
+        elif name.isidentifier() and name not in excluded and os.path.isfile(os.path.join(path, '__init__.py')):
+            # extension modules and data files (which may be opened relative to __file__) must stay on disk
+            if all(
+                i.endswith('.py') or re.match(BUNDLE_IGNORED_RE, i)
+                for root, dirs, files in os.walk(path) if os.path.basename(root) != '__pycache__'
+                for i in files
+            ):
+                yield name
+
+
+def make_bundle(site_packages_dirs, bundle_fname):
+    """pack pure python packages from site-packages, with their bytecode, into a zip importable from sys.path
+
+    Installed files stay where they are, so that tracebacks and pip keep working.
+    """
+
+    import importlib.util
+    import py_compile
+    import zipfile
+
+    tmp_fname = '{}.{}.tmp'.format(bundle_fname, os.getpid())
+
+    # stored, not deflated, so importing does not need decompression
+    with zipfile.ZipFile(tmp_fname, 'w', zipfile.ZIP_STORED) as z:
+        for site_packages, name in [(i, j) for i in site_packages_dirs for j in bundle_candidates(i)]:
+            path = os.path.join(site_packages, name)
+            sources = [path] if os.path.isfile(path) else [
+                os.path.join(root, i)
+                for root, dirs, files in os.walk(path) if os.path.basename(root) != '__pycache__'
+                for i in files if i.endswith('.py')
+            ]
+
+            for source in sorted(sources):
+                arcname = os.path.relpath(source, site_packages).replace(os.sep, '/')
+                z.write(source, arcname)
+
+                # zipimport cannot write bytecode, but uses "<module>.pyc" next to the source
+                pyc = importlib.util.cache_from_source(source)
+
+                if not os.path.exists(pyc):
+                    try:
+                        py_compile.compile(source, doraise=True)
+                    except py_compile.PyCompileError:
+                        continue
+
+                z.write(pyc, arcname + 'c')
+
+    os.replace(tmp_fname, bundle_fname)
+
+
+def bootstrap_pip(cache_dir, wheelhouse, upgrade, pip_verbose):
+    """return a sys.path entry to import pip from in venvs without pip, or None if pip is not available
+
+    pip is taken from the wheelhouse, or else from the cache (the newest wheel in it), which gets
+    seeded with the pip of PIP_VERSIONS (unless installing from a wheelhouse, which is meant to work
+    offline, or the one bundled with "ensurepip" is newer), or with the bundled one, once per
+    Python version. Wheels are unpacked and compiled in the cache once, as importing pip from a
+    wheel means compiling it on every run.
+    """
+
+    import glob
+    import shutil
+    import tempfile
+
+    def newest(pattern):
+        wheels = [i for i in glob.glob(pattern) if version_key(os.path.basename(i).split('-')[1]) is not None]
+        return max(wheels, key=lambda i: version_key(os.path.basename(i).split('-')[1])) if wheels else None
+
+    # newer pips may not support older Pythons
+    wheels_dir = os.path.join(cache_dir, 'bootstrap-wheels', 'py{}.{}'.format(*sys.version_info[:2]))
+    os.makedirs(wheels_dir, exist_ok=True)
+
+    wheel = (wheelhouse and newest(os.path.join(wheelhouse, 'pip-*.whl'))) or newest(os.path.join(wheels_dir, 'pip-*.whl'))
+
+    if wheel is None:
+        try:
+            import ensurepip
+        except ImportError:
+            return None
+
+        bundled = newest(os.path.join(os.path.dirname(ensurepip.__file__), '_bundled', 'pip-*.whl'))
+
+        if bundled is None:
+            return None
+
+        pip_version = PIP_VERSIONS.get(sys.version_info[:2], PIP_VERSION)
+        bundled_version = os.path.basename(bundled).split('-')[1]
+
+        with tempfile.TemporaryDirectory(dir=wheels_dir) as tmpdir:
+            # a wheelhouse made with "venv-bootstrap-wheelhouse --no-pip" has no pip in it
+            if upgrade and not wheelhouse and version_key(bundled_version) < version_key(pip_version):
+                import subprocess
+
+                pip_download = [
+                    '--isolated', '--disable-pip-version-check', 'download', '--only-binary', ':all:', '--no-deps',
+                    '--dest', tmpdir, 'pip=={}'.format(pip_version)
+                ]
+
+                # pip supports being run from its wheel
+                subprocess.call([sys.executable, os.path.join(bundled, 'pip')] + pip_verbose + pip_download, stdout=sys.stderr)
+
+            wheel = newest(os.path.join(tmpdir, 'pip-*.whl'))
+
+            if wheel is None:
+                wheel = os.path.join(tmpdir, os.path.basename(bundled))
+                shutil.copyfile(bundled, wheel)
+
+            os.replace(wheel, os.path.join(wheels_dir, os.path.basename(wheel)))
+            wheel = os.path.join(wheels_dir, os.path.basename(wheel))
+
+    unpacked = os.path.join(wheels_dir, os.path.basename(wheel)[:-len('.whl')])
+
+    if not os.path.isdir(unpacked):
+        import zipfile
+
+        tmpdir = tempfile.mkdtemp(dir=wheels_dir)
+
+        try:
+            with zipfile.ZipFile(wheel) as z:
+                z.extractall(tmpdir)
+
+            precompile([tmpdir])
+            os.rename(tmpdir, unpacked)
+        except OSError:
+            # e.g. unpacked concurrently
+            if not os.path.isdir(unpacked):
+                raise
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return unpacked
+
+
+def precompile(paths, unchecked_hash=False):
+    """compile all modules under paths to bytecode, using all CPUs where supported
+
+    This is done by "python -m compileall" rather than in-process, as worker processes started
+    by "spawn" would re-execute this script.
+    """
+
+    import subprocess
+
+    options = ['-q']
+
+    if sys.version_info >= (3, 5):
+        options += ['-j', '0']
+
+    if unchecked_hash and sys.version_info >= (3, 7):
+        # no source mtime checks on imports
+        options += ['--invalidation-mode', 'unchecked-hash']
+
+    subprocess.check_call([sys.executable, '-m', 'compileall'] + options + paths, stdout=sys.stderr)
+
+
+def exec_or_call(exe, argv):
+    """replace the current process with "exe argv...", never returns
+
+    Where exec is not available (or does not preserve the process identity, as on Windows),
+    the command is run as a subprocess instead, with terminating signals forwarded to it
+    and its exit code passed through.
+    """
+
+    if os.name == 'posix':
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(exe, [exe] + argv)
+
+    import subprocess
+
+    process = subprocess.Popen([exe] + argv)
+
+    def forward(signum, frame):
+        try:
+            process.send_signal(signum)
+        except (OSError, ValueError):
+            # the child has already exited or the signal cannot be sent on this platform,
+            # e.g. SIGINT on Windows, which the console delivers to the child by itself
+            pass
+
+    for name in ['SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT', 'SIGBREAK']:
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), forward)
+
+    sys.exit(process.wait())
+
+
+def server_address(venv_dir, module, install, lock):
+    """return the socket path of the server running module in venv_dir, or None if servers cannot be used
+
+    The path depends on everything which affects the venv, so that servers of outdated venvs
+    are never connected to, and eventually time out.
+    """
+
+    import stat
+
+    venv_state = [read_file(os.path.join(venv_dir, i)) for i in [STAMP_FNAME, FINGERPRINT_FNAME]]
+
+    if None in venv_state:
+        return None
+
+    key = text_digest('\n'.join([VERSION, os.path.realpath(venv_dir), module, install, lock or ''] + venv_state))
+
+    # e.g. TMPDIR on macOS is too long for socket paths
+    for base in [os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR'), '/tmp']:
+        address = os.path.join(base or '/tmp', 'venv-bootstrap-{}'.format(os.getuid()), key[:32] + '.sock')
+
+        if len(os.fsencode(address)) < MAX_SOCKET_PATH:
+            break
+    else:
+        return None
+
+    run_dir = os.path.dirname(address)
+
+    try:
+        os.mkdir(run_dir, 0o700)
+    except FileExistsError:
         pass
 
+    # anyone able to create sockets here could run code on our behalf
+    st = os.lstat(run_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None
+
+    return address
+
+
+def server_call(address, request, fail_code):
+    """run request in a worker of the server listening at address, passing it our stdin, stdout and stderr
+
+    Returns the exit code of the worker, or None if the server is not available.
+    """
+
+    import array
+    import json
+    import socket
+    import struct
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        s.connect(address)
+        payload = json.dumps(request).encode()
+        data = struct.pack('!I', len(payload)) + payload
+        sent = s.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [0, 1, 2]))])
+        s.sendall(data[sent:])
+        reply = s.makefile('r')
+        line = reply.readline().split()
+    except OSError:
+        s.close()
+        return None
+
+    # e.g. "stale"
+    if line[:1] != ['pid']:
+        s.close()
+        return None
+
+    pid = int(line[1])
+
+    def forward(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    for name in ['SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT']:
+        signal.signal(getattr(signal, name), forward)
+
+    line = reply.readline().split()
+    s.close()
+
+    if line[:1] != ['exit']:
+        sys.stderr.write('error: lost connection to the server running the module\n')
+        return fail_code
+
+    return int(line[1])
+
+
+def recv_request(conn):
+    """receive a request sent by server_call(), returning it and the passed file descriptors"""
+
+    import array
+    import json
+    import socket
+    import struct
+
+    fds = array.array('i')
+    data, ancdata, flags, addr = conn.recvmsg(65536, socket.CMSG_SPACE(3 * fds.itemsize))
+
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+
+    try:
+        while len(data) < 4 or len(data) < 4 + struct.unpack('!I', data[:4])[0]:
+            chunk = conn.recv(65536)
+
+            if not chunk:
+                raise EOFError()
+
+            data += chunk
+
+        if len(fds) != 3:
+            raise EOFError()
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+    return json.loads(data[4:].decode()), list(fds)
+
+
+def serve(address, timeout, is_valid, run):
+    """serve requests at address, each by run(request) in a worker forked from this process
+
+    Stops once idle for timeout seconds, or when is_valid() becomes false. Only one server
+    serves any address, further ones return immediately.
+    """
+
+    import fcntl
+    import select
+    import socket
+
+    with open(address + '.lock', 'ab') as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+
+        if os.path.exists(address):
+            os.remove(address)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+        listener.listen(64)
+
+        # worker exits wake select() up
+        wakeup_r, wakeup_w = os.pipe()
+        # os.set_blocking() is Python 3.5+
+        for fd in [wakeup_r, wakeup_w]:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        signal.set_wakeup_fd(wakeup_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        workers = {}
+        deadline = time.monotonic() + timeout
+
+        def stop_listening():
+            os.remove(address)
+            # pending connections get reset, and their clients fall back to running the module themselves
+            listener.close()
+
+        while listener.fileno() != -1 or workers:
+            if listener.fileno() != -1 and not workers and time.monotonic() > deadline:
+                stop_listening()
+                continue
+
+            try:
+                ready = select.select(
+                    [wakeup_r] + ([listener] if listener.fileno() != -1 else []),
+                    [],
+                    [],
+                    None if workers else max(0, deadline - time.monotonic())
+                )[0]
+            except InterruptedError:
+                # Python 3.4 does not retry system calls interrupted by SIGCHLD (PEP 475)
+                ready = [wakeup_r]
+
+            if wakeup_r in ready:
+                try:
+                    os.read(wakeup_r, 4096)
+                except BlockingIOError:
+                    pass
+
+            while workers:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+
+                if pid == 0:
+                    break
+
+                if pid in workers:
+                    code = 128 + os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+                    try:
+                        workers[pid].sendall('exit {}\n'.format(code).encode())
+                    except OSError:
+                        pass
+
+                    workers.pop(pid).close()
+
+            if listener in ready:
+                conn, _ = listener.accept()
+
+                try:
+                    conn.settimeout(10)
+                    request, fds = recv_request(conn)
+                except (OSError, EOFError, ValueError):
+                    conn.close()
+                    continue
+
+                if not is_valid():
+                    conn.sendall(b'stale\n')
+                    conn.close()
+
+                    for fd in fds:
+                        os.close(fd)
+
+                    stop_listening()
+                    continue
+
+                pid = os.fork()
+
+                if pid == 0:
+                    code = 1
+
+                    try:
+                        signal.set_wakeup_fd(-1)
+                        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+                        for i in [listener, conn] + list(workers.values()):
+                            i.close()
+
+                        os.close(wakeup_r)
+                        os.close(wakeup_w)
+
+                        for target, fd in enumerate(fds):
+                            os.dup2(fd, target)
+                            os.close(fd)
+
+                        code = run(request)
+                    finally:
+                        os._exit(code)
+
+                for fd in fds:
+                    os.close(fd)
+
+                try:
+                    conn.sendall('pid {}\n'.format(pid).encode())
+                except OSError:
+                    pass
+
+                workers[pid] = conn
+                deadline = time.monotonic() + timeout
+
+
+def launcher_script(launch_fname, used_fname, key, env_exe, module, fallback):
+    """return a launcher running module by env_exe directly while launch_fname has key in it, touching
+    used_fname (see mark_used()), and "fallback... <arguments>" otherwise: a shell script, or a batch file on Windows
+    """
+
+    if os.name == 'nt':
+        import subprocess
+
+        def quote(i):
+            return subprocess.list2cmdline([i]).replace('%', '%%')
+
+        # newlines are translated by write_file()
+        return '\n'.join([
+            '@echo off',
+            'rem generated by venv-bootstrap.py, do not edit',
+            'setlocal',
+            'set venv_bootstrap_key=',
+            'set /p venv_bootstrap_key=<{} 2>nul'.format(quote(launch_fname)),
+            'if not "%venv_bootstrap_key%"=="{}" goto bootstrap'.format(key),
+            'type nul >{} 2>nul'.format(quote(used_fname)),
+            '{} -m {} %*'.format(quote(env_exe), quote(module)),
+            'exit /b %errorlevel%',
+            ':bootstrap',
+            '{} %*'.format(' '.join(quote(i) for i in fallback)),
+            'exit /b %errorlevel%',
+            ''
+        ])
+
+    import shlex
+
+    return '\n'.join([
+        '#!/bin/sh',
+        '# generated by venv-bootstrap.py, do not edit',
+        'venv_bootstrap_key=',
+        '{{ read -r venv_bootstrap_key < {}; }} 2>/dev/null'.format(shlex.quote(launch_fname)),
+        'if [ "$venv_bootstrap_key" = {} ]; then'.format(key),
+        '    touch {} 2>/dev/null'.format(shlex.quote(used_fname)),
+        '    exec {} -m {} "$@"'.format(shlex.quote(env_exe), shlex.quote(module)),
+        'fi',
+        'exec {} "$@"'.format(' '.join(shlex.quote(i) for i in fallback)),
+        ''
+    ])
+
+
+def parsed_argv(parser, args, exclude):
+    """return a command line which parser parses as args, leaving out the arguments with dests in exclude"""
+
+    options = []
+    positionals = []
+
+    for action in parser._actions:
+        value = getattr(args, action.dest, None)
+
+        if action.dest in exclude or value is None or value == action.default:
+            continue
+
+        if not action.option_strings:
+            positionals.append(value)
+        elif action.nargs == 0:
+            options.append(action.option_strings[0])
+        else:
+            options += [action.option_strings[0], str(value)]
+
+    return options + positionals
+
+
+def read_manifest(fname):
+    """return {module: (environment, install)} as listed in the manifest, or {} if there is none
+
+    The manifest maps modules to shared environments, each installed by a single install spec:
+
+        {"environments": {"<environment>": {"modules": ["<module>", ...], "install": "<install>"}, ...}}
+
+    Raises ValueError if the manifest is malformed.
+    """
+
+    contents = read_file(fname)
+
+    if contents is None:
+        return {}
+
+    import json
+
+    manifest = json.loads(contents)
+    environments = manifest.get('environments') if isinstance(manifest, dict) else None
+
+    if not isinstance(environments, dict):
+        raise ValueError('"environments" must be an object')
+
+    result = {}
+
+    for name, environment in sorted(environments.items()):
+        if not re.match(r'^[A-Za-z0-9_][A-Za-z0-9_.-]*$', name):
+            raise ValueError('invalid environment name "{}"'.format(name))
+
+        modules = environment.get('modules') if isinstance(environment, dict) else None
+        install = environment.get('install') if isinstance(environment, dict) else None
+
+        modules_ok = isinstance(modules, list) and all(isinstance(i, str) for i in modules)
+
+        if not modules_ok or not isinstance(install, str):
+            raise ValueError('environment "{}" must have "modules" list and "install" string'.format(name))
+
+        for module in modules:
+            if module in result:
+                raise ValueError('module "{}" is listed in both "{}" and "{}"'.format(module, result[module][0], name))
+
+            result[module] = (name, install)
+
+    return result
+
+
+class Timing:
+    """wall clock durations of bootstrap phases, written as a single JSON line per process"""
+
+    def __init__(self, dest, role, module, spawned_at=None):
+        self.dest = dest
+        self.role = role
+        self.module = module
+        self.phases = {}
+        self.written = False
+
+        if spawned_at is not None:
+            self.phases['spawn'] = start_time - spawned_at
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.time() - start
+
+    def write(self, **extra):
+        """write the timings once, if requested"""
+
+        if not self.dest or self.written:
+            return
+
+        import json
+
+        self.written = True
+        record = dict(
+            role=self.role,
+            module=self.module,
+            pid=os.getpid(),
+            version=VERSION,
+            start=start_time,
+            total=time.time() - start_time,
+            phases=self.phases
+        )
+        record.update(extra)
+        line = json.dumps(record, sort_keys=True) + '\n'
+
+        if self.dest == '-':
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            # a single append keeps lines from concurrent bootstraps apart
+            fd = os.open(self.dest, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+
 
 env_var_venv = os.environ.get('VENV_BOOTSTRAP_PY_ENV')
+env_var_wheelhouse = os.environ.get('VENV_BOOTSTRAP_PY_WHEELHOUSE')
+env_var_cache_dir = os.environ.get('VENV_BOOTSTRAP_PY_CACHE')
+env_var_timing = os.environ.get('VENV_BOOTSTRAP_PY_TIMING')
 default_venv_prefix = os.path.join(os.path.dirname(__file__), '.venv.')
 default_venv_for_display = default_venv_prefix + "<module>"
 
@@ -85,13 +1259,61 @@ parser.add_argument(
 )
 parser.add_argument(
     'install',
-    help='quoted string to be parsed with "shlex.split" and passed as "pip install" parameters'
+    help='quoted string to be parsed with "shlex.split" and passed as "pip install" parameters. '
+         'Note: ignored for modules listed in "{}" next to venv-bootstrap.py, which are run from '
+         'the environment shared by the listed modules (default venv: "{}"), '
+         'installed by its install spec'.format(MANIFEST_FNAME, default_venv_prefix + '<environment>')
 )
 parser.add_argument(
     '--venv', metavar='PATH',
     help='venv directory path, relative to venv-bootstrap.py. '
          'Note: can be overriden by VENV_BOOTSTRAP_PY_ENV environment variable (default: "{}")'.format(default_venv_for_display)
 )
+parser.add_argument(
+    '--wheelhouse', metavar='PATH',
+    help='install from wheels in the local directory only, without consulting any package index '
+         '(see "venv-bootstrap-wheelhouse"). '
+         'Note: can be overriden by VENV_BOOTSTRAP_PY_WHEELHOUSE environment variable'
+)
+parser.add_argument(
+    '--lock', action='store_true',
+    help='record exact versions and hashes of installed distributions into "venv-bootstrap.<module>.lock" '
+         'next to venv-bootstrap.py, and install from it with "--no-deps --require-hashes" from then on. '
+         'The lock is recorded anew when the install spec changes'
+)
+parser.add_argument(
+    '--cache-dir', metavar='PATH',
+    help='directory for data shared between venvs, such as templates. '
+         'Note: can be overriden by VENV_BOOTSTRAP_PY_CACHE environment variable (default: "{}")'.format(default_cache_dir())
+)
+parser.add_argument(
+    '--template', action='store_true',
+    help='clone new venvs from a template venv in the cache directory, shared by all bootstraps '
+         'by the same interpreter with the same install spec, using hardlinks where possible. '
+         'The template is made from the first venv installed'
+)
+parser.add_argument(
+    '--store', action='store_true',
+    help='deduplicate disk space taken by installed distributions across venvs: once "pip" has installed them, '
+         'their files are replaced with hardlinks into a content-addressed store in the cache directory '
+         '(see "venv-bootstrap-prune-store"). '
+         'Note: this does not make installation faster, as "pip" still downloads, unpacks and writes every '
+         'distribution into each venv'
+)
+parser.add_argument(
+    '--wait-timeout',
+    metavar='N',
+    type=float,
+    default=600,
+    help='seconds to wait for a concurrent bootstrap of the same venv to finish (default: %(default)s)'
+)
+parser.add_argument(
+    '--timing', metavar='DEST',
+    help='append a JSON line with durations of bootstrap phases to the DEST file ("-" for stderr), '
+         'one from the process creating the venv, one from the process installing into it, if needed, '
+         'and one from the process running the module. '
+         'Note: can be overriden by VENV_BOOTSTRAP_PY_TIMING environment variable'
+)
 parser.add_argument(
     '--verbose', action='store_true',
     help="give more output"
@@ -106,7 +1328,51 @@ parser.add_argument(
 parser.add_argument(
     '--no-pip-upgrade',
     action='store_true',
-    help="do not upgrade setuptools and pip during bootstrap"
+    help='run "pip" bundled with Python instead of downloading a newer one (pinned by venv-bootstrap.py) '
+         'when first caching it. '
+         'Note: pip is not installed into venvs, unless required by the install spec'
+)
+parser.add_argument(
+    '--bundle', action='store_true',
+    help='import pure python packages from a single zip made after installation, '
+         'instead of from many files in site-packages, e.g. for venvs on network filesystems. '
+         'Note: a venv modified other than by venv-bootstrap.py should be bootstrapped without this option'
+)
+parser.add_argument(
+    '--server', action='store_true',
+    help='keep a background server with the module imported, which runs later invocations in forked workers '
+         '(POSIX only). The server stops after "--server-timeout" seconds without invocations, or when the venv changes. '
+         'Note: suitable for non-interactive modules only, as workers are not attached to the terminal'
+)
+parser.add_argument(
+    '--server-timeout',
+    metavar='N',
+    type=float,
+    default=600,
+    help='seconds a server waits for invocations before stopping (default: %(default)s)'
+)
+parser.add_argument(
+    '--no-precompile',
+    action='store_true',
+    help='leave compiling installed modules to "pip", instead of doing it in parallel after installation'
+)
+parser.add_argument(
+    '--unchecked-hash-pyc',
+    action='store_true',
+    help='precompile to hash-based .pyc files which are not checked against sources on import (Python 3.7+). '
+         'Note: editing installed sources will have no effect'
+)
+parser.add_argument(
+    '--prepare-only', action='store_true',
+    help='make the venv and install into it, if needed, without running the module (see "venv-bootstrap-prepare")'
+)
+parser.add_argument(
+    '--launcher', metavar='PATH',
+    help='write a launcher to PATH (a shell script, or a batch file on Windows), which runs the module '
+         'from the venv directly, passing its arguments on, for as long as the venv is unchanged by venv-bootstrap.py, '
+         'and runs venv-bootstrap.py with the same options otherwise. '
+         'Note: relative paths in options are relative to the directory the launcher is run from, and launches '
+         'mark venvs as used, but do not hold them in use (see "venv-bootstrap-gc"). Cannot be used with "--bundle"'
 )
 parser.add_argument(
     '--fail-code',
@@ -123,21 +1389,100 @@ parser.add_argument(
     help='arguments and options to pass to the module. Prepend with "--" to pass anything starting with "-"'
 )
 parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--spawned-at', type=float, help=argparse.SUPPRESS)
+parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
 
 args = parser.parse_args()
 
+# the options as given by the user, before environment variables and the manifest apply, for launchers to fall back to
+launcher_argv = parsed_argv(parser, args, ['args', 'child', 'spawned_at', 'serve'])
+
+if args.launcher and args.bundle:
+    # launchers run the module by the venv's interpreter as is, with no bundle on sys.path
+    parser.error('"--launcher" cannot be used with "--bundle"')
+
+if env_var_timing:
+    args.timing = env_var_timing
+
+if args.serve:
+    args.timing = None
+
+if os.name != 'posix':
+    args.server = False
+
+timing = Timing(args.timing, 'child' if args.child else 'parent', args.module, args.spawned_at)
+timing.phases['parse'] = time.time() - start_time
+
+# the command line as given to the parent, which puts "--child [--spawned-at T]" in front of it, and
+# "--serve" in front of that for servers
+user_argv = sys.argv[1:]
+internal_args = {'--child': 1, '--serve': 1, '--spawned-at': 2}
+
+while user_argv[:1] and user_argv[0] in internal_args:
+    user_argv = user_argv[internal_args[user_argv[0]]:]
+
+manifest_fname = os.path.join(os.path.dirname(__file__), MANIFEST_FNAME)
+
+try:
+    manifest = read_manifest(manifest_fname)
+except ValueError as e:
+    parser.error('invalid "{}": {}'.format(manifest_fname, e))
+
+# venvs and locks are per environment, each module being an environment of its own unless listed in the manifest
+environment = args.module
+
+if args.module in manifest:
+    environment, args.install = manifest[args.module]
+
+lock_fname = os.path.join(os.path.dirname(__file__), 'venv-bootstrap.{}.lock'.format(environment))
+
+if env_var_wheelhouse:
+    args.wheelhouse = env_var_wheelhouse
+
+if env_var_cache_dir:
+    args.cache_dir = env_var_cache_dir
+elif args.cache_dir is None:
+    args.cache_dir = default_cache_dir()
+
+
+def exec_child(exe):
+    """run the module by exe in a new child process (or the current one, where exec is available)"""
+
+    child_args = ['--child']
+
+    if args.timing:
+        timing.write()
+        child_args += ['--spawned-at', repr(time.time())]
+
+    exec_or_call(exe, [__file__] + child_args + user_argv)
+
+
 if args.child:
     def error(msg=None):
         if msg:
             sys.stderr.writelines(["error: ", msg, "\n"])
 
+        timing.write(failed=True)
         sys.exit(args.fail_code)
 
+    # e.g. run by a stale launcher, which must not install into the base interpreter
+    if sys.prefix == getattr(sys, 'base_prefix', sys.prefix):
+        error('"--child" must be run by the interpreter of a venv, not by "{}"'.format(sys.executable))
+
     def info(msg):
         if args.verbose:
             sys.stderr.write(msg)
 
     def run_and_exit():
+        if args.timing:
+            import importlib.util
+
+            # imports the module's parent packages, leaving running it to runpy
+            with timing.phase('import'):
+                importlib.util.find_spec(args.module)
+
+        timing.write()
+
         old_argv = sys.argv
         try:
             sys.argv = ["python -m {}".format(args.module)] + args.args
@@ -147,52 +1492,309 @@ if args.child:
         finally:
             sys.argv = old_argv
 
-    try:
-        run_and_exit()
-    except ImportError:
-        pass
+    def run_request(request):
+        """run the module in a server's worker as requested by server_call(), returning the exit code"""
 
-    info('Failed to find "{}", trying to install using "pip"\n'.format(args.module))
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.umask(request['umask'])
+        args.args = request['args']
 
-    pip_verbose = ['--verbose'] * args.pip_verbosity
+        for f in [sys.stdout, sys.stderr]:
+            if hasattr(f, 'reconfigure'):
+                f.reconfigure(line_buffering=f.isatty())
 
-    do_bootstrap = False
-    try:
-        import pip
-    except ImportError:
-        do_bootstrap = True
+        try:
+            try:
+                run_and_exit()
+            except ImportError as e:
+                error("{}".format(e))
+        except SystemExit as e:
+            code = e.code
+        except BaseException:
+            import traceback
 
-    if do_bootstrap:
-        # note: do not do this in exception handler to avoid confusing "exception while
-        # handling exception" kinds of tracebacks
+            traceback.print_exc()
+            code = 1
 
-        info('Bootstrapping "pip" using "ensurepip"\n')
+        # the same as the interpreter does on exit
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            sys.stderr.write('{}\n'.format(code))
+            code = 1
 
-        # note: ensurepip cannot be executed in-process, as it imports pip from
-        # a temporary copy of a wheel which is destroyed upon return, leaving
-        # no non-hackish ways of using pip afterwards.
-        subprocess.check_call(
-            [sys.executable, '-m', 'ensurepip', '--altinstall'] + pip_verbose,
-            stdout=sys.stderr
-        )
+        for f in [sys.stdout, sys.stderr]:
+            try:
+                f.flush()
+            except (OSError, ValueError):
+                pass
 
-        if not args.no_pip_upgrade:
-            subprocess.check_call(
-                [sys.executable, '-m', 'pip'] + pip_verbose + ['--isolated', 'install', '--upgrade', 'setuptools'],
-                stdout=sys.stderr
-            )
-            subprocess.check_call(
-                [sys.executable, '-m', 'easy_install', '--upgrade', 'pip'],
-                stdout=sys.stderr
-            )
+        return code
+
+    def pip_install(install_args, report_fname=None):
+        """run "pip install", optionally writing an installation report
+
+        Returns False if a report was requested, but is not supported by the available pip.
+        """
+
+        pip_verbose = ['--verbose'] * args.pip_verbosity
+        pip_index = ['--no-index', '--find-links', args.wheelhouse] if args.wheelhouse else []
+        # pip compiles serially, so it is done by precompile() instead
+        pip_compile = [] if args.no_precompile else ['--no-compile']
+
+        do_bootstrap = False
+        try:
+            import pip
+        except ImportError:
+            do_bootstrap = True
+
+        if do_bootstrap:
+            # note: do not do this in exception handler to avoid confusing "exception while
+            # handling exception" kinds of tracebacks
+
+            with timing.phase('pip_bootstrap'):
+                pip_path = bootstrap_pip(args.cache_dir, args.wheelhouse, not args.no_pip_upgrade, pip_verbose)
+
+            if pip_path is not None:
+                info('Importing "pip" from "{}"\n'.format(pip_path))
+                # after site-packages, so that pip installed by the install spec takes precedence
+                sys.path.append(pip_path)
+            else:
+                import subprocess
+
+                info('Bootstrapping "pip" using "ensurepip"\n')
+
+                # note: ensurepip cannot be executed in-process, as it imports pip from
+                # a temporary copy of a wheel which is destroyed upon return, leaving
+                # no non-hackish ways of using pip afterwards.
+                with timing.phase('ensurepip'):
+                    subprocess.check_call(
+                        [sys.executable, '-m', 'ensurepip', '--altinstall'] + pip_verbose,
+                        stdout=sys.stderr
+                    )
+
+            import pip  # noqa
+            import glob
+            import importlib.util
+
+            # pips older than 22.1 build sdists by setuptools from the venv, rather than from an isolated
+            # build environment, so new venvs get it, as they did from "ensurepip", unless installing
+            # from a lock (which has it, if recorded here) or a wheelhouse without it
+            pip_version = version_key(pip.__version__)
+            old_pip = pip_version is not None and pip_version < version_key('22.1')
+            has_setuptools = importlib.util.find_spec('setuptools') is not None
+            can_install = not args.wheelhouse or bool(glob.glob(os.path.join(args.wheelhouse, 'setuptools-*.whl')))
+
+            if old_pip and not has_setuptools and can_install and '--require-hashes' not in install_args:
+                install_args = ['setuptools'] + install_args
+
+        pip_report = []
+
+        if report_fname:
+            pip_version = version_key(pip.__version__)
+
+            if pip_version is None or pip_version < version_key('22.2'):
+                report_fname = None
+            else:
+                # installed distributions would be omitted from the report otherwise
+                pip_report = ['--ignore-installed', '--report', report_fname]
+
+        with timing.phase('pip_install'), contextlib.redirect_stdout(sys.stderr):
+            pip_options = pip_index + pip_compile + pip_report
+
+            if pip.main(pip_verbose + ['--isolated', '--disable-pip-version-check', 'install'] + pip_options + install_args):
+                error()
 
-        import pip  # noqa
+        if not args.no_precompile:
+            with timing.phase('precompile'):
+                precompile(site_packages_dirs(), args.unchecked_hash_pyc)
+
+        return report_fname is not None
+
+    def site_packages_dirs():
+        import sysconfig
+
+        return sorted(set(sysconfig.get_paths()[i] for i in ['purelib', 'platlib']))
 
     import shlex
 
-    with contextlib.redirect_stdout(sys.stderr):
-        if pip.main(pip_verbose + ['--isolated', 'install'] + shlex.split(args.install, posix=False)):
-            error()
+    install_args = shlex.split(args.install, posix=False)
+    fingerprint = install_fingerprint(install_args)
+    fingerprint_fname = os.path.join(sys.prefix, FINGERPRINT_FNAME)
+    bundle_fname = os.path.join(sys.prefix, BUNDLE_FNAME)
+    lock = None
+
+    if args.lock:
+        lock = read_file(lock_fname)
+
+        # a lock recorded for another install spec is stale
+        if lock is not None and '\n# ' + fingerprint not in lock:
+            lock = None
+
+        if lock is not None:
+            fingerprint += 'lock {}\n'.format(text_digest(lock))
+
+    # the install spec is trusted as long as it is the one last installed into this venv
+    if read_file(fingerprint_fname) != fingerprint:
+        # concurrent bootstraps of the same venv wait for the one doing the installation
+        with venv_lock(sys.prefix, args.wait_timeout, args.fail_code, timing):
+            if read_file(fingerprint_fname) != fingerprint:
+                # launchers must not run the module while it is being installed
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(sys.prefix, LAUNCH_FNAME))
+
+                # would shadow whatever gets installed
+                if os.path.exists(bundle_fname):
+                    os.remove(bundle_fname)
+
+                if lock is not None:
+                    info('Installing from "{}" using "pip"\n'.format(lock_fname))
+                    pip_install(['--no-deps', '--require-hashes', '-r', lock_fname])
+
+                elif args.lock:
+                    import tempfile
+
+                    info('Installing {} using "pip" and recording "{}"\n'.format(args.install, lock_fname))
+
+                    with tempfile.TemporaryDirectory() as tmpdir:
+                        report_fname = os.path.join(tmpdir, 'report.json')
+
+                        if pip_install(install_args, report_fname):
+                            lock = make_lock(report_fname, fingerprint)
+
+                    if lock is None:
+                        sys.stderr.write('warning: not all installed distributions can be pinned by hash, not recording a lock\n')
+                    else:
+                        write_file(lock_fname, lock)
+                        fingerprint += 'lock {}\n'.format(text_digest(lock))
+
+                else:
+                    with timing.phase('check'):
+                        missing_args = unsatisfied_requirements(install_args, site_packages_dirs())
+
+                    if missing_args:
+                        info('Installing {} using "pip"\n'.format(' '.join(missing_args)))
+                        pip_install(missing_args)
+
+                if args.store:
+                    info('Storing installed distributions in "{}"\n'.format(os.path.join(args.cache_dir, 'store')))
+
+                    with timing.phase('store'):
+                        for site_packages in site_packages_dirs():
+                            store_site_packages(os.path.join(args.cache_dir, 'store'), site_packages)
+
+                write_file(fingerprint_fname, fingerprint)
+
+                if args.template:
+                    # the template is keyed by the interpreter which created the venv, not by the one in it
+                    stamp = read_file(os.path.join(sys.prefix, STAMP_FNAME)) or ''
+                    template = template_dir(args.cache_dir, stamp.rpartition('env_exe ')[0], install_args)
+
+                    if not os.path.exists(template):
+                        info('Making template "{}"\n'.format(template))
+
+                        with timing.phase('template'):
+                            seed_template(sys.prefix, template)
+
+        # the module gets a fresh interpreter, rather than one with pip and its state loaded, and
+        # finds what has just been installed the same way as on later launches
+        if 'pip' in sys.modules and not args.prepare_only:
+            timing.role = 'install'
+            exec_child(sys.executable)
+
+    if args.bundle and not os.path.exists(bundle_fname):
+        with venv_lock(sys.prefix, args.wait_timeout, args.fail_code, timing):
+            if not os.path.exists(bundle_fname):
+                info('Making bundle "{}"\n'.format(bundle_fname))
+
+                with timing.phase('bundle'):
+                    make_bundle(site_packages_dirs(), bundle_fname)
+
+    if args.bundle:
+        # after the script's directory, before site-packages
+        sys.path.insert(1, bundle_fname)
+
+    # servers are started with the options of a process which has already written the launcher
+    if args.launcher and not args.serve:
+        def venv_launch_key():
+            # a new interpreter or install spec changes either
+            contents = [read_file(os.path.join(sys.prefix, i)) or '' for i in [STAMP_FNAME, FINGERPRINT_FNAME]]
+            return text_digest(''.join(contents))[:32]
+
+        stamp = read_file(os.path.join(sys.prefix, STAMP_FNAME)) or ''
+        launch_key = venv_launch_key()
+        launch_fname = os.path.join(os.path.abspath(sys.prefix), LAUNCH_FNAME)
+
+        python = dict(i.partition(' ')[::2] for i in stamp.splitlines()).get('executable', sys.executable)
+        launcher = launcher_script(
+            launch_fname,
+            os.path.join(os.path.abspath(sys.prefix), USED_FNAME),
+            launch_key,
+            os.path.abspath(sys.executable),
+            args.module,
+            [python, os.path.abspath(__file__)] + launcher_argv + ['--']
+        )
+
+        if read_file(args.launcher) != launcher:
+            info('Writing launcher "{}"\n'.format(args.launcher))
+            write_file(args.launcher, launcher, 0o755)
+
+        if read_file(launch_fname) != launch_key + '\n':
+            # unless a concurrent bootstrap has changed the venv since
+            with venv_lock(sys.prefix, args.wait_timeout, args.fail_code, timing):
+                if venv_launch_key() == launch_key:
+                    write_file(launch_fname, launch_key + '\n')
+
+    if args.prepare_only:
+        timing.write()
+        sys.exit(0)
+
+    if args.serve:
+        address = server_address(sys.prefix, args.module, args.install, read_file(lock_fname) if args.lock else None)
+
+        if address is None:
+            sys.exit(0)
+
+        def venv_state():
+            try:
+                return [
+                    (st.st_ino, st.st_mtime_ns)
+                    for st in [os.stat(os.path.join(sys.prefix, i)) for i in [STAMP_FNAME, FINGERPRINT_FNAME]]
+                ]
+            except OSError:
+                return None
+
+        started_state = venv_state()
+
+        import importlib
+        import importlib.util
+
+        # packages are imported in advance, while modules are left to be run by runpy, as only
+        # the former can be expected to have no side effects on import
+        try:
+            spec = importlib.util.find_spec(args.module)
+
+            if spec is not None and spec.submodule_search_locations is not None:
+                importlib.import_module(args.module)
+        except Exception:
+            sys.exit(0)
+
+        serve(address, args.server_timeout, lambda: venv_state() == started_state, run_request)
+        sys.exit(0)
+
+    if args.server:
+        import subprocess
+
+        # a fresh process, so that the server has nothing but the module imported
+        subprocess.Popen(
+            [sys.executable, __file__, '--serve', '--child'] + user_argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
 
     try:
         run_and_exit()
@@ -203,9 +1805,61 @@ else:
     if env_var_venv:
         args.venv = env_var_venv
     elif args.venv is None:
-        args.venv = default_venv_prefix + args.module
+        args.venv = default_venv_prefix + environment
 
-    builder = EnvBuilder(symlinks=os.name != 'nt')
-    builder.create(args.venv)
-    signal.signal(signal.SIGINT, lambda n, s: None)
-    sys.exit(subprocess.call([builder.last_context.env_exe, __file__, '--child'] + sys.argv[1:]))
+    # warm start: a venv created by this very interpreter and script version
+    # is reused as is, without going through "venv" machinery
+    env_exe = read_stamp(args.venv)
+
+    # the venv being removed by "venv-bootstrap-gc" is waited for by the locked path below
+    if env_exe is not None and not hold_in_use(args.venv, wait=False):
+        env_exe = None
+
+    if env_exe is not None and args.server and not args.prepare_only:
+        address = server_address(args.venv, args.module, args.install, read_file(lock_fname) if args.lock else None)
+
+        if address is not None:
+            mark_used(args.venv)
+
+            umask = os.umask(0)
+            os.umask(umask)
+
+            with timing.phase('server'):
+                code = server_call(
+                    address,
+                    dict(args=args.args, env=dict(os.environ), cwd=os.getcwd(), umask=umask),
+                    args.fail_code
+                )
+
+            if code is not None:
+                timing.write(server=True)
+                sys.exit(code)
+
+    if env_exe is None:
+        # concurrent bootstraps of the same venv wait for the one creating it
+        with venv_lock(args.venv, args.wait_timeout, args.fail_code, timing):
+            env_exe = read_stamp(args.venv)
+
+            if env_exe is None and args.template and not os.path.exists(os.path.join(args.venv, 'pyvenv.cfg')):
+                import shlex
+
+                template = template_dir(args.cache_dir, interpreter_stamp(), shlex.split(args.install, posix=False))
+
+                if os.path.exists(os.path.join(template, TEMPLATE_FNAME)):
+                    try:
+                        with timing.phase('template'):
+                            clone_template(template, args.venv)
+                    except OSError:
+                        # a partial clone has no stamp, and gets fixed up by the regular bootstrap below
+                        pass
+
+                    env_exe = read_stamp(args.venv)
+
+            if env_exe is None:
+                with timing.phase('venv'):
+                    env_exe = create_venv(args.venv)
+
+            hold_in_use(args.venv)
+
+    mark_used(args.venv)
+    exec_child(env_exe)
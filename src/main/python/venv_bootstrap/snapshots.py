@@ -0,0 +1,261 @@
+import contextlib
+import os
+import time
+from .cache import BUNDLE_FNAME, FINGERPRINT_FNAME, INUSE_FNAME, LAUNCH_FNAME, LOCK_FNAME, STAMP_FNAME, TEMPLATE_FNAME, USED_FNAME
+
+# not worth carrying over, or specific to the machine the venv was made on
+EXCLUDED = [LOCK_FNAME, TEMPLATE_FNAME, BUNDLE_FNAME, USED_FNAME, INUSE_FNAME, LAUNCH_FNAME]
+# stands for the venv location in archived files and symlinks, which are marked by RELOCATE_HEADER
+PLACEHOLDER = '<venv-bootstrap-snapshot-prefix>'
+RELOCATE_HEADER = 'VENV_BOOTSTRAP.relocate'
+# larger files are archived as is
+MAX_RELOCATE_SIZE = 1000000
+# the same interpreter properties as recorded in venv stamps by venv-bootstrap.py, except for its path,
+# which restore() relocates venvs to
+INTERPRETER_KEYS = ['version', 'abi', 'platform']
+INTERPRETER_SCRIPT = '''
+import os, sys
+machine = os.uname().machine if hasattr(os, 'uname') else os.environ.get('PROCESSOR_ARCHITECTURE', '')
+base_executable = os.path.abspath(getattr(sys, '_base_executable', sys.executable))
+print('version ' + sys.version.replace('\\n', ' '))
+print('abi ' + sys.implementation.cache_tag + getattr(sys, 'abiflags', ''))
+print('platform ' + sys.platform + '-' + machine)
+print('executable ' + sys.executable)
+print('base_executable ' + base_executable)
+print('real_executable ' + os.path.realpath(base_executable))
+'''
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _text_digest(text):
+    import hashlib
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _read_file(fname):
+    try:
+        with open(fname) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _parse_lines(text):
+    return dict(i.partition(' ')[::2] for i in text.splitlines())
+
+
+def install_fingerprint(install, lock=None):
+    """return what venv-bootstrap.py records as installed into a venv for an install spec and,
+    if given, the contents of its "--lock" file
+    """
+
+    import shlex
+
+    fingerprint = 'spec {}\n'.format(_text_digest('\n'.join(shlex.split(install, posix=False))))
+
+    # a lock recorded for another install spec is not used
+    if lock is not None and '\n# ' + fingerprint in lock:
+        fingerprint += 'lock {}\n'.format(_text_digest(lock))
+
+    return fingerprint
+
+
+def query_interpreter(python):
+    """return the properties of python which make venvs made by it not interchangeable"""
+
+    import subprocess
+
+    try:
+        output = subprocess.check_output([python, '-c', INTERPRETER_SCRIPT], universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise SnapshotError('failed to run "{}": {}'.format(python, e))
+
+    return _parse_lines(output)
+
+
+def snapshot_key(interpreter, bootstrap_version, fingerprint):
+    lines = ['bootstrap {}\n'.format(bootstrap_version)]
+    lines += ['{} {}\n'.format(i, interpreter.get(i)) for i in INTERPRETER_KEYS]
+
+    return _text_digest(''.join(lines) + fingerprint)[:32]
+
+
+def archive_name(key):
+    return '{}.tar'.format(key)
+
+
+def venv_key(venv):
+    """return the snapshot key of a venv made by venv-bootstrap.py"""
+
+    stamp = _read_file(os.path.join(venv, STAMP_FNAME))
+    fingerprint = _read_file(os.path.join(venv, FINGERPRINT_FNAME))
+
+    if stamp is None or fingerprint is None:
+        raise SnapshotError('"{}" is not a venv installed by venv-bootstrap.py'.format(venv))
+
+    stamp = _parse_lines(stamp)
+
+    return snapshot_key(stamp, stamp.get('bootstrap'), fingerprint)
+
+
+def export(venv, dest_dir):
+    """write a relocatable archive of venv into dest_dir, returning its path
+
+    Files and symlinks referring to the venv by absolute path get it replaced by PLACEHOLDER,
+    leaving out binary files (such as .pyc, where it only serves tracebacks).
+    """
+
+    import io
+    import tarfile
+
+    venv = os.path.abspath(venv)
+    prefix = venv.encode()
+    fname = os.path.join(dest_dir, archive_name(venv_key(venv)))
+    tmp_fname = '{}.{}.tmp'.format(fname, os.getpid())
+
+    os.makedirs(dest_dir, exist_ok=True)
+
+    try:
+        with tarfile.open(tmp_fname, 'w', format=tarfile.PAX_FORMAT) as tar:
+            for root, dirs, files in os.walk(venv):
+                dirs.sort()
+                rel_root = os.path.relpath(root, venv)
+
+                for name in dirs + sorted(files):
+                    if rel_root == '.' and name in EXCLUDED:
+                        continue
+
+                    path = os.path.join(root, name)
+                    info = tar.gettarinfo(path, os.path.normpath(os.path.join(rel_root, name)))
+                    contents = None
+
+                    if info.issym() and info.linkname.startswith(venv):
+                        info.linkname = PLACEHOLDER + info.linkname[len(venv):]
+                        info.pax_headers[RELOCATE_HEADER] = '1'
+
+                    elif info.isreg() and info.size < MAX_RELOCATE_SIZE:
+                        with open(path, 'rb') as f:
+                            contents = f.read()
+
+                        if prefix in contents and b'\0' not in contents:
+                            contents = contents.replace(prefix, PLACEHOLDER.encode())
+                            info.size = len(contents)
+                            info.pax_headers[RELOCATE_HEADER] = '1'
+
+                    if contents is not None:
+                        tar.addfile(info, io.BytesIO(contents))
+                    elif info.isreg():
+                        with open(path, 'rb') as f:
+                            tar.addfile(info, f)
+                    else:
+                        tar.addfile(info)
+
+                # os.walk would not descend into symlinked directories anyway
+                dirs[:] = [i for i in dirs if not os.path.islink(os.path.join(root, i))]
+
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_fname)
+        raise
+
+    return fname
+
+
+def relocate_interpreter(venv, interpreter):
+    """point a venv made by venv-bootstrap.py at the same interpreter (see query_interpreter())
+    installed at another location
+    """
+
+    import re
+
+    stamp_fname = os.path.join(venv, STAMP_FNAME)
+    stamp = _read_file(stamp_fname)
+
+    if stamp is not None:
+        with open(stamp_fname, 'w') as f:
+            f.write(re.sub(r'^executable .*$', lambda m: 'executable ' + interpreter['executable'], stamp, flags=re.MULTILINE))
+
+    cfg_fname = os.path.join(venv, 'pyvenv.cfg')
+    cfg = _read_file(cfg_fname)
+    old_home = cfg and re.search(r'^home\s*=\s*(.*?)\s*$', cfg, re.MULTILINE)
+
+    if not old_home:
+        return
+
+    old_home = old_home.group(1)
+    new_home = os.path.dirname(interpreter['base_executable'])
+    values = {'home': new_home, 'executable': interpreter['real_executable']}
+
+    with open(cfg_fname, 'w') as f:
+        f.write(re.sub(
+            r'^(home|executable)(\s*=\s*).*$',
+            lambda m: m.group(1) + m.group(2) + values[m.group(1)],
+            cfg,
+            flags=re.MULTILINE
+        ))
+
+    # symlinks made by "venv" to the interpreter
+    for scripts in ['bin', 'Scripts']:
+        scripts = os.path.join(venv, scripts)
+
+        for name in os.listdir(scripts) if os.path.isdir(scripts) else []:
+            path = os.path.join(scripts, name)
+
+            if os.path.islink(path) and os.path.dirname(os.readlink(path)) == old_home:
+                os.remove(path)
+                os.symlink(interpreter['base_executable'], path)
+
+
+def restore(fname, venv, interpreter=None):
+    """extract an archive made by export() as venv, which must not exist
+
+    The archive is extracted in a single pass, relocating marked members on the way, into a
+    temporary directory next to venv, which is then renamed, so that venv is never seen partial.
+    If given, the venv is also pointed at interpreter (see relocate_interpreter()).
+    """
+
+    import shutil
+    import tarfile
+
+    venv = os.path.abspath(venv)
+
+    if os.path.lexists(venv):
+        raise SnapshotError('"{}" already exists'.format(venv))
+
+    tmp_venv = os.path.join(os.path.dirname(venv), '.{}.snapshot.{}'.format(os.path.basename(venv), os.getpid()))
+    # symlinks to the interpreter are absolute, which the "data" filter would reject
+    extract_args = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+
+    try:
+        os.makedirs(tmp_venv)
+
+        with tarfile.open(fname, 'r|') as tar:
+            for member in tar:
+                if os.path.isabs(member.name) or '..' in member.name.split('/'):
+                    raise SnapshotError('unexpected member "{}" in "{}"'.format(member.name, fname))
+
+                if RELOCATE_HEADER not in member.pax_headers:
+                    tar.extract(member, tmp_venv, **extract_args)
+                elif member.issym():
+                    os.symlink(venv + member.linkname[len(PLACEHOLDER):], os.path.join(tmp_venv, member.name))
+                else:
+                    path = os.path.join(tmp_venv, member.name)
+
+                    with open(path, 'wb') as f:
+                        f.write(tar.extractfile(member).read().replace(PLACEHOLDER.encode(), venv.encode()))
+
+                    os.chmod(path, member.mode)
+                    os.utime(path, (time.time(), member.mtime))
+
+        if interpreter is not None:
+            relocate_interpreter(tmp_venv, interpreter)
+
+        os.rename(tmp_venv, venv)
+    except BaseException:
+        shutil.rmtree(tmp_venv, ignore_errors=True)
+        raise
@@ -0,0 +1,65 @@
+import os
+import time
+
+# references younger than this are kept even if not (yet) linked into a venv,
+# as a bootstrap may still be populating it
+MIN_REF_AGE = 3600
+
+
+def _nop_msg_cb(msg):
+    pass
+
+
+def is_ref_live(entry, dist_info):
+    """check whether a venv still uses the files of a store entry"""
+
+    metadata = os.path.join('files', os.path.basename(dist_info), 'METADATA')
+
+    try:
+        return os.path.samefile(os.path.join(entry, metadata), os.path.join(dist_info, 'METADATA'))
+    except OSError:
+        return False
+
+
+def prune(store, *, dry_run=False, info_cb=_nop_msg_cb):
+    """remove store entries not referenced by any existing venv, returning the number of entries removed"""
+
+    if not os.path.isdir(store):
+        return 0
+
+    removed = 0
+    now = time.time()
+
+    for name in sorted(os.listdir(store)):
+        entry = os.path.join(store, name)
+        refs = os.path.join(entry, 'refs')
+        live = False
+
+        try:
+            ref_names = os.listdir(refs)
+        except OSError:
+            ref_names = []
+
+        for ref_name in ref_names:
+            ref = os.path.join(refs, ref_name)
+
+            try:
+                with open(ref) as f:
+                    dist_info = f.read()
+                age = now - os.path.getmtime(ref)
+            except OSError:
+                continue
+
+            if is_ref_live(entry, dist_info) or age < MIN_REF_AGE:
+                live = True
+            elif not dry_run:
+                os.remove(ref)
+
+        if not live:
+            info_cb('removing "{}"'.format(entry))
+            removed += 1
+            if not dry_run:
+                import shutil
+                shutil.rmtree(entry, ignore_errors=True)
+
+    return removed
@@ -0,0 +1,172 @@
+import os
+import re
+import time
+from .cache import INUSE_FNAME, LOCK_FNAME, STAMP_FNAME, USED_FNAME, try_lock
+from .discovery import IGNORED_DIRS, walk
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def _nop_msg_cb(msg):
+    pass
+
+
+def parse_size(text):
+    """parse sizes like "500M" or "2G" (powers of 1024) into bytes, raising ValueError if malformed"""
+
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*$', text, re.IGNORECASE)
+
+    if not match:
+        raise ValueError('invalid size "{}"'.format(text))
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def format_size(size):
+    for unit in ['', 'K', 'M', 'G']:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'T'
+
+    return '{:.1f}{}'.format(size, unit) if unit else '{}'.format(size)
+
+
+def find_venvs(root, *, warn_cb=_nop_msg_cb):
+    """yield venvs made by venv-bootstrap.py below root, including root itself"""
+
+    def is_venv(path, files):
+        return STAMP_FNAME in files
+
+    for path, files in walk(root, ignore=lambda name: name in IGNORED_DIRS, prune=is_venv, warn_cb=warn_cb):
+        if is_venv(path, files):
+            yield path
+
+
+def last_used(venv):
+    """return the time venv was last used, as recorded by venv-bootstrap.py, or made"""
+
+    for i in [USED_FNAME, STAMP_FNAME]:
+        try:
+            return os.stat(os.path.join(venv, i)).st_mtime
+        except OSError:
+            pass
+
+    return 0
+
+
+def disk_usage(path):
+    """return the total size of files below path, counting hardlinked files once"""
+
+    seen = set()
+    total = 0
+
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+
+    return total
+
+
+def is_in_use(venv):
+    """check whether venv-bootstrap.py holds a lock on venv (see remove()), without creating lock files"""
+
+    for i in [INUSE_FNAME, LOCK_FNAME]:
+        try:
+            fd = os.open(os.path.join(venv, i), os.O_RDWR)
+        except OSError:
+            continue
+
+        try:
+            if not try_lock(fd):
+                return True
+        finally:
+            os.close(fd)
+
+    return False
+
+
+def remove(venv):
+    """remove venv unless it is in use, returning whether it was removed
+
+    venv-bootstrap.py holds a shared lock on INUSE_FNAME (on POSIX) for as long as a module
+    runs from the venv, and an exclusive one on LOCK_FNAME while making or installing into it.
+    """
+
+    fds = []
+
+    try:
+        for i in [INUSE_FNAME, LOCK_FNAME]:
+            fds.append(os.open(os.path.join(venv, i), os.O_RDWR | os.O_CREAT, 0o666))
+
+            if not try_lock(fds[-1]):
+                return False
+
+        if os.name == 'nt':
+            # open files prevent renaming their directory
+            for fd in fds:
+                os.close(fd)
+            fds = []
+
+        # venv-bootstrap.py finds the venv gone once our locks are released
+        doomed = os.path.join(os.path.dirname(venv), '.{}.removed.{}'.format(os.path.basename(venv), os.getpid()))
+        os.rename(venv, doomed)
+    except OSError:
+        return False
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+    import shutil
+    shutil.rmtree(doomed, ignore_errors=True)
+
+    return True
+
+
+def collect(roots, *, max_age=None, max_size=None, dry_run=False, info_cb=_nop_msg_cb, warn_cb=_nop_msg_cb):
+    """remove venvs below roots not used for max_age seconds, then least recently used ones
+    while their total size exceeds max_size
+
+    Returns the number of venvs removed and the number of bytes freed.
+    """
+
+    now = time.time()
+    venvs = sorted(
+        (last_used(path), path, disk_usage(path))
+        for root in roots
+        for path in find_venvs(root, warn_cb=warn_cb)
+    )
+    total = sum(size for _, _, size in venvs)
+    removed = 0
+    freed = 0
+
+    for used, path, size in venvs:
+        expired = max_age is not None and now - used > max_age
+        over_size = max_size is not None and total > max_size
+
+        if not expired and not over_size:
+            # the rest is used more recently
+            break
+
+        if dry_run:
+            removable = not is_in_use(path)
+        else:
+            removable = remove(path)
+
+        if removable:
+            info_cb('removing "{}" ({}, last used {:.1f} days ago)'.format(path, format_size(size), (now - used) / 86400))
+            total -= size
+            removed += 1
+            freed += size
+        else:
+            warn_cb('skipping "{}", which is in use'.format(path))
+
+    return removed, freed
@@ -0,0 +1,191 @@
+import os
+from .cache import BUNDLE_FNAME, LOCK_FNAME, try_lock
+
+
+def _nop_msg_cb(msg):
+    pass
+
+
+class Problem:
+    def __init__(self, dist_info, path, what):
+        self.dist_info = dist_info
+        self.path = path
+        self.what = what
+
+    def __str__(self):
+        return '{}: "{}" {}'.format(os.path.basename(self.dist_info), self.path, self.what)
+
+
+def venv_python(venv):
+    if os.name == 'nt':
+        return os.path.join(venv, 'Scripts', 'python.exe')
+
+    return os.path.join(venv, 'bin', 'python')
+
+
+def site_packages_dirs(venv):
+    import glob
+
+    paths = glob.glob(os.path.join(venv, 'lib*', 'python*', 'site-packages')) + \
+        glob.glob(os.path.join(venv, 'Lib', 'site-packages'))
+
+    # e.g. lib64 is often a symlink to lib
+    return sorted(set(os.path.realpath(i) for i in paths))
+
+
+def read_record(dist_info):
+    """return (path, algorithm, digest, size) of files in a RECORD which have a hash"""
+
+    import csv
+
+    with open(os.path.join(dist_info, 'RECORD'), newline='') as f:
+        rows = [i for i in csv.reader(f) if len(i) == 3 and i[1]]
+
+    return [(path, hash.partition('=')[0], hash.partition('=')[2], size) for path, hash, size in rows]
+
+
+def check_file(path, algorithm, digest, size):
+    """return what is wrong with a file installed from a wheel, or None"""
+
+    import base64
+    import hashlib
+    import mmap
+
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 'is missing'
+
+    if size and st.st_size != int(size):
+        return 'has size {} instead of {}'.format(st.st_size, size)
+
+    h = hashlib.new(algorithm)
+
+    if st.st_size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            # hashlib releases the GIL for large buffers, so files get hashed in parallel
+            h.update(m)
+
+    if base64.urlsafe_b64encode(h.digest()).rstrip(b'=').decode() != digest:
+        return 'has wrong {} hash'.format(algorithm)
+
+    return None
+
+
+def verify(venv, *, jobs=1):
+    """check files of distributions installed into venv against their RECORD, with jobs threads
+
+    Files outside of site-packages, such as scripts, are only checked for existence, as
+    venv-bootstrap.py rewrites the venv location in them when cloning templates.
+
+    Returns the number of files checked and a list of Problem's.
+    """
+
+    import glob
+    from concurrent.futures import ThreadPoolExecutor
+
+    checks = []
+    problems = []
+
+    for site_packages in site_packages_dirs(venv):
+        for dist_info in sorted(glob.glob(os.path.join(site_packages, '*.dist-info'))):
+            try:
+                record = read_record(dist_info)
+            except (OSError, ValueError) as e:
+                problems.append(Problem(dist_info, 'RECORD', 'cannot be read: {}'.format(e)))
+                continue
+
+            for path, algorithm, digest, size in record:
+                checks.append((dist_info, path, os.path.join(site_packages, path), algorithm, digest, size))
+
+    def check(args):
+        dist_info, path, fname, algorithm, digest, size = args
+
+        try:
+            if path.startswith('..'):
+                what = None if os.path.exists(fname) else 'is missing'
+            else:
+                what = check_file(fname, algorithm, digest, size)
+        except (OSError, ValueError) as e:
+            what = 'cannot be checked: {}'.format(e)
+
+        return what and Problem(dist_info, path, what)
+
+    with ThreadPoolExecutor(jobs) as pool:
+        problems += [i for i in pool.map(check, checks) if i]
+
+    return len(checks), problems
+
+
+def _dist_requirement(dist_info):
+    name, _, version = os.path.basename(dist_info)[:-len('.dist-info')].rpartition('-')
+    return '{}=={}'.format(name, version)
+
+
+def _cached_pip(venv, cache_dir):
+    """return a directory with pip unpacked by venv-bootstrap.py for the Python version of venv, or None"""
+
+    import glob
+    import re
+    from .version import InvalidVersion, parse_version
+
+    try:
+        with open(os.path.join(venv, 'pyvenv.cfg')) as f:
+            match = re.search(r'^version(?:_info)?\s*=\s*(\d+)\.(\d+)', f.read(), re.MULTILINE)
+    except OSError:
+        match = None
+
+    if not match:
+        return None
+
+    candidates = []
+
+    for path in glob.glob(os.path.join(cache_dir, 'bootstrap-wheels', 'py{}.{}'.format(*match.groups()), 'pip-*')):
+        try:
+            if os.path.isdir(path):
+                candidates.append((parse_version(os.path.basename(path).split('-')[1]), path))
+        except (IndexError, InvalidVersion):
+            pass
+
+    return max(candidates)[1] if candidates else None
+
+
+def repair(venv, dist_infos, *, cache_dir, wheelhouse=None, info_cb=_nop_msg_cb, error_cb=_nop_msg_cb):
+    """reinstall distributions of venv by pip, without dependencies, returning whether it succeeded
+
+    pip is taken from the venv, if it has it, or from the cache of venv-bootstrap.py.
+    """
+
+    import subprocess
+
+    python = venv_python(venv)
+    env = dict(os.environ)
+
+    if subprocess.call([python, '-c', 'import pip'], stderr=subprocess.DEVNULL):
+        pip_path = _cached_pip(venv, cache_dir)
+
+        if pip_path is None:
+            error_cb('no pip found in "{}" or in "{}"'.format(venv, cache_dir))
+            return False
+
+        env['PYTHONPATH'] = pip_path
+
+    requirements = sorted(set(_dist_requirement(i) for i in dist_infos))
+    pip_index = ['--no-index', '--find-links', wheelhouse] if wheelhouse else []
+    pip_args = ['--isolated', '--disable-pip-version-check', 'install', '--force-reinstall', '--no-deps'] + pip_index
+
+    with open(os.path.join(venv, LOCK_FNAME), 'ab') as lock:
+        # a concurrent bootstrap is installing into the venv
+        if not try_lock(lock.fileno()):
+            error_cb('"{}" is locked by venv-bootstrap.py'.format(venv))
+            return False
+
+        # made from the broken files, and shadowing whatever gets reinstalled
+        try:
+            os.remove(os.path.join(venv, BUNDLE_FNAME))
+        except FileNotFoundError:
+            pass
+
+        info_cb('reinstalling {}'.format(' '.join(requirements)))
+
+        return subprocess.call([python, '-m', 'pip'] + pip_args + requirements, env=env) == 0
@@ -0,0 +1,97 @@
+import re
+
+# a lightweight replacement for pkg_resources.parse_version / packaging.version, which are slow to import
+
+VERSION_RE = re.compile(
+    r'^\s*v?'
+    r'(?:(?P<epoch>\d+)!)?'
+    r'(?P<release>\d+(?:\.\d+)*)'
+    r'(?:[-_.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<pre_n>\d*))?'
+    r'(?:-(?P<post_n1>\d+)|[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>\d*))?'
+    r'(?:[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>\d*))?'
+    r'(?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?'
+    r'\s*$',
+    re.IGNORECASE
+)
+
+PRE_RELEASE_RANKS = {'a': 0, 'alpha': 0, 'b': 1, 'beta': 1, 'c': 2, 'rc': 2, 'pre': 2, 'preview': 2}
+
+
+class InvalidVersion(ValueError):
+    pass
+
+
+class Version:
+    """a PEP 440 version, comparable with other instances"""
+
+    def __init__(self, version):
+        m = VERSION_RE.match(version)
+        if not m:
+            raise InvalidVersion('invalid version: "{}"'.format(version))
+
+        self.public = version
+        release = [int(i) for i in m.group('release').split('.')]
+        while len(release) > 1 and release[-1] == 0:
+            release.pop()
+
+        is_pre = m.group('pre_l') is not None
+        is_post = m.group('post_n1') is not None or m.group('post_l') is not None
+        is_dev = m.group('dev_l') is not None
+
+        if is_pre:
+            pre = (0, PRE_RELEASE_RANKS[m.group('pre_l').lower()], int(m.group('pre_n') or 0))
+        elif is_dev and not is_post:
+            # 1.0.dev0 sorts before 1.0a0
+            pre = (-1,)
+        else:
+            pre = (1,)
+
+        local = m.group('local')
+        if local is None:
+            local_key = ()
+        else:
+            # numeric segments sort after alphanumeric ones
+            local_key = tuple(
+                (1, int(i), '') if i.isdigit() else (0, 0, i.lower())
+                for i in re.split(r'[-_.]', local)
+            )
+
+        self._key = (
+            int(m.group('epoch') or 0),
+            tuple(release),
+            pre,
+            (0, int(m.group('post_n1') or m.group('post_n2') or 0)) if is_post else (-1,),
+            (0, int(m.group('dev_n') or 0)) if is_dev else (1,),
+            local_key
+        )
+
+    def __repr__(self):
+        return '<Version({!r})>'.format(self.public)
+
+    def __str__(self):
+        return self.public
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __eq__(self, other):
+        return self._key == other._key
+
+    def __ne__(self, other):
+        return self._key != other._key
+
+    def __lt__(self, other):
+        return self._key < other._key
+
+    def __le__(self, other):
+        return self._key <= other._key
+
+    def __gt__(self, other):
+        return self._key > other._key
+
+    def __ge__(self, other):
+        return self._key >= other._key
+
+
+def parse_version(version):
+    return Version(version)
@@ -1,10 +1,19 @@
+import ast
+import json
 import os
+import shlex
+import shutil
 import subprocess
 import sys
 import tempfile
+import time
 import unittest
+import unittest.mock
+import zipfile
 import venv_bootstrap
-from venv_bootstrap.installer import Installer, SCRIPT_UUID
+from click.testing import CliRunner
+from venv_bootstrap import cli, venvs
+from venv_bootstrap.installer import CheckCache, Installer, SCRIPT_UUID
 
 # Note: this is not intended as an exhaustive test suite but
 # rather as a smoke test.
@@ -95,6 +104,341 @@ class InstallerCheckTestCase(unittest.TestCase):
             self.assertEqual(installer.check(), 'version-newer')
 
 
+class CheckCacheTestCase(unittest.TestCase):
+    def test_cached(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_fname = os.path.join(tmpdir, 'cache', 'check-cache.json')
+            installer = Installer(tmpdir, CheckCache(cache_fname))
+            with open(installer.fname, "wb") as f:
+                f.writelines([SCRIPT_UUID, b'\nVERSION = "99999999.0"\n'])
+            os.utime(installer.fname, (0, 0))
+            self.assertEqual(installer.check(), 'version-newer')
+            installer.check_cache.save()
+
+            # same size and mtime, different contents
+            with open(installer.fname, "wb") as f:
+                f.writelines([SCRIPT_UUID, b'\nVERSION = "00000000.0"\n'])
+            os.utime(installer.fname, (0, 0))
+            self.assertEqual(Installer(tmpdir, CheckCache(cache_fname)).check(), 'version-newer')
+            self.assertEqual(Installer(tmpdir).check(), 'version-older')
+
+    def test_evicted(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_fname = os.path.join(tmpdir, 'check-cache.json')
+            paths = [os.path.join(tmpdir, i) for i in ['kept', 'removed', 'new']]
+
+            for path in paths[:2]:
+                os.mkdir(path)
+                installer = Installer(path, CheckCache(cache_fname))
+                with open(installer.fname, "wb") as f:
+                    f.writelines([SCRIPT_UUID, b'\nVERSION = "99999999.0"\n'])
+                os.utime(installer.fname, (0, 0))
+                installer.check()
+                installer.check_cache.save()
+
+            shutil.rmtree(paths[1])
+            os.mkdir(paths[2])
+            installer = Installer(paths[2], CheckCache(cache_fname))
+            with open(installer.fname, "wb") as f:
+                f.writelines([SCRIPT_UUID, b'\nVERSION = "99999999.0"\n'])
+            os.utime(installer.fname, (0, 0))
+            installer.check()
+            installer.check_cache.save()
+
+            with open(cache_fname) as f:
+                entries = json.load(f)['entries']
+
+            fnames = [os.path.join(paths[i], 'venv-bootstrap.py') for i in [0, 2]]
+            self.assertEqual(sorted(i[1] for i in entries.values()), fnames)
+
+    def test_racy(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            installer = Installer(tmpdir, CheckCache(os.path.join(tmpdir, 'check-cache.json')))
+            with open(installer.fname, "wb") as f:
+                f.writelines([SCRIPT_UUID, b'\nVERSION = "99999999.0"\n'])
+            self.assertEqual(installer.check(), 'version-newer')
+
+            with open(installer.fname, "wb") as f:
+                f.writelines([SCRIPT_UUID, b'\nVERSION = "00000000.0"\n'])
+            self.assertEqual(installer.check(), 'version-older')
+
+
+class InstallerCliTestCase(unittest.TestCase):
+    def test_jobs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dirs = [os.path.join(tmpdir, str(i)) for i in range(8)]
+            for i in dirs:
+                os.mkdir(i)
+            open(Installer(dirs[3]).fname, 'wb').close()
+
+            result = CliRunner().invoke(cli.main, ['--jobs', '4', '--no-interactive', '--no-cache'] + dirs)
+            self.assertEqual(result.exit_code, 1)
+            self.assertEqual(
+                result.output.splitlines(),
+                [
+                    'installing into "{}"'.format(i) if i != dirs[3] else
+                    'error: cowardly refusing to overwrite "{}" missing our signature'.format(Installer(i).fname)
+                    for i in dirs
+                ]
+            )
+            self.assertEqual([Installer(i).check() for i in dirs].count('version-same'), 7)
+
+    def test_recursive(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def make(*path):
+                os.makedirs(os.path.join(tmpdir, *path[:-1]), exist_ok=True)
+                open(os.path.join(tmpdir, *path), 'wb').close()
+
+            make('a', 'b', 'tool.cfg')
+            make('a', 'c', 'other.txt')
+            make('d', '.git', 'tool.cfg')
+            make('d', '.venv.x', 'tool.cfg')
+            make('d', 'node_modules', 'e', 'tool.cfg')
+            os.mkdir(os.path.join(tmpdir, 'f'))
+            Installer(os.path.join(tmpdir, 'f')).install()
+
+            for jobs, first in [('1', 'installing into'), ('4', 'already installed in')]:
+                result = CliRunner().invoke(
+                    cli.main,
+                    ['--no-interactive', '--no-cache', '--jobs', jobs, '--recursive', tmpdir, '--marker', '*.cfg']
+                )
+                self.assertEqual(result.exit_code, 0)
+                self.assertEqual(
+                    result.output.splitlines(),
+                    [
+                        '{} "{}"'.format(first, os.path.join(tmpdir, 'a', 'b')),
+                        'already installed in "{}"'.format(os.path.join(tmpdir, 'f')),
+                    ]
+                )
+
+            # given explicitly, and found below overlapping roots
+            roots = ['--recursive', tmpdir, '--recursive', os.path.join(tmpdir, 'a')]
+            result = CliRunner().invoke(
+                cli.main,
+                ['--no-interactive', '--no-cache', '--jobs', '4', '--marker', '*.cfg'] + roots + [os.path.join(tmpdir, 'f')]
+            )
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(
+                result.output.splitlines(),
+                [
+                    'already installed in "{}"'.format(os.path.join(tmpdir, 'f')),
+                    'already installed in "{}"'.format(os.path.join(tmpdir, 'a', 'b')),
+                ]
+            )
+
+
+class GcTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.root = self._tempdir.name
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def _venv(self, name, days_unused, size):
+        path = os.path.join(self.root, 'project', name)
+        os.makedirs(os.path.join(path, 'lib'))
+
+        with open(os.path.join(path, venvs.STAMP_FNAME), 'w'):
+            pass
+
+        with open(os.path.join(path, 'lib', 'data'), 'wb') as f:
+            f.write(b'x' * size)
+
+        used = os.path.join(path, venvs.USED_FNAME)
+        with open(used, 'w'):
+            pass
+        os.utime(used, (time.time() - days_unused * 86400,) * 2)
+
+        return path
+
+    def test_parse_size(self):
+        self.assertEqual(venvs.parse_size('10'), 10)
+        self.assertEqual(venvs.parse_size('1.5K'), 1536)
+        self.assertEqual(venvs.parse_size('2GiB'), 2 * 1024 ** 3)
+        self.assertRaises(ValueError, venvs.parse_size, 'lots')
+
+    def test_days(self):
+        old = self._venv('.venv.old', 10, 100)
+        new = self._venv('.venv.new', 1, 100)
+
+        result = CliRunner().invoke(cli.gc, ['--days', '5', self.root])
+        self.assertEqual(result.exit_code, 0)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+        result = CliRunner().invoke(cli.gc, ['--days', '-1', self.root])
+        self.assertEqual(result.exit_code, 2)
+
+    def test_max_size(self):
+        paths = [self._venv('.venv.{}'.format(i), i, 1000) for i in range(4)]
+
+        result = CliRunner().invoke(cli.gc, ['--max-size', '2500', self.root])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual([os.path.exists(i) for i in paths], [True, True, False, False])
+
+    def test_dry_run(self):
+        old = self._venv('.venv.old', 10, 100)
+
+        result = CliRunner().invoke(cli.gc, ['--dry-run', '--days', '5', self.root])
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(old in result.output)
+        self.assertTrue(os.path.exists(old))
+
+    @unittest.skipUnless(os.name == 'posix', 'POSIX only')
+    def test_in_use(self):
+        import fcntl
+
+        old = self._venv('.venv.old', 10, 100)
+
+        with open(os.path.join(old, venvs.INUSE_FNAME), 'w') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            removed, freed = venvs.collect([self.root], max_age=0)
+
+        self.assertEqual(removed, 0)
+        self.assertTrue(os.path.exists(old))
+
+    @unittest.skipUnless(os.name == 'posix', 'POSIX only')
+    def test_dry_run_in_use(self):
+        import fcntl
+
+        old = self._venv('.venv.old', 10, 100)
+        skipped = []
+
+        with open(os.path.join(old, venvs.INUSE_FNAME), 'w') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            removed, freed = venvs.collect([self.root], max_age=0, dry_run=True, warn_cb=skipped.append)
+
+        self.assertEqual(removed, 0)
+        self.assertEqual(len(skipped), 1)
+        self.assertFalse(os.path.exists(os.path.join(old, venvs.LOCK_FNAME)))
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires Python 3.7")
+class ImportTimeTestCase(unittest.TestCase):
+    # see "Import time" in README.md
+    BUDGET_US = 30000
+    HEAVY_MODULES = ['pkg_resources', 'setuptools_scm', 'atomicwrites', 'concurrent.futures', 'subprocess', 'json']
+
+    def test_cli(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+
+        with subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', 'import venv_bootstrap.cli'],
+            stderr=subprocess.PIPE,
+            env=env,
+            universal_newlines=True
+        ) as process:
+            _, stderr = process.communicate()
+
+        self.assertEqual(process.returncode, 0)
+
+        cumulative = {}
+        # lines after the header look like "import time: <self us> | <cumulative us> | <indented name>"
+        for line in stderr.splitlines()[1:]:
+            _, us, name = line.split('|')
+            cumulative.setdefault(name.strip(), int(us))
+
+        for i in self.HEAVY_MODULES:
+            self.assertNotIn(i, cumulative)
+
+        # click is the bulk of it and is needed anyway
+        self.assertLess(cumulative['venv_bootstrap.cli'] - cumulative['click'], self.BUDGET_US)
+
+
+def script_namespace():
+    """return functions, classes and constants of venv-bootstrap.py, which runs when imported"""
+
+    fname = os.path.join(os.path.dirname(venv_bootstrap.__file__), 'res', 'venv-bootstrap.py')
+
+    with open(fname) as f:
+        tree = ast.parse(f.read(), fname)
+
+    def is_definition(node):
+        if isinstance(node, ast.Assign):
+            return all(isinstance(i, ast.Name) and i.id.isupper() for i in node.targets)
+
+        return isinstance(node, (ast.Import, ast.FunctionDef, ast.ClassDef))
+
+    tree.body = [i for i in tree.body if is_definition(i)]
+    namespace = {}
+    exec(compile(tree, fname, 'exec'), namespace)
+
+    return namespace
+
+
+class RequirementsTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.script = script_namespace()
+
+    def _satisfies(self, version, op, spec_version):
+        return self.script['version_satisfies'](version, op, spec_version)
+
+    def test_compatible_release(self):
+        self.assertTrue(self._satisfies('1.4.5', '~=', '1.4.0'))
+        self.assertTrue(self._satisfies('1.4', '~=', '1.4.0'))
+        self.assertFalse(self._satisfies('1.5', '~=', '1.4.0'))
+        self.assertFalse(self._satisfies('1.3.9', '~=', '1.4.0'))
+        self.assertTrue(self._satisfies('1.5', '~=', '1.4'))
+        self.assertFalse(self._satisfies('2.0', '~=', '1.4'))
+        self.assertEqual(self._satisfies('1.5', '~=', '1'), None)
+
+    def test_greater_than_post_release(self):
+        self.assertFalse(self._satisfies('1.0.post1', '>', '1.0'))
+        self.assertTrue(self._satisfies('1.1', '>', '1.0'))
+        self.assertTrue(self._satisfies('1.0.post2', '>', '1.0.post1'))
+
+    def test_equal_trailing_zeros(self):
+        self.assertTrue(self._satisfies('1.0', '==', '1'))
+        self.assertTrue(self._satisfies('1', '==', '1.0.0'))
+        self.assertFalse(self._satisfies('1.0.1', '==', '1.0'))
+
+    def test_installed_path(self):
+        with tempfile.TemporaryDirectory() as site_packages, tempfile.TemporaryDirectory() as other:
+            os.mkdir(os.path.join(site_packages, 'foo-1.0.dist-info'))
+
+            with open(os.path.join(site_packages, 'foo-1.0.dist-info', 'METADATA'), 'w') as f:
+                f.write('Metadata-Version: 2.1\nName: foo\nVersion: 1.0\n')
+
+            unsatisfied = self.script['unsatisfied_requirements']
+            self.assertEqual(unsatisfied(['foo==1.0', 'bar'], [site_packages]), ['bar'])
+            self.assertEqual(unsatisfied(['foo>1.0'], [site_packages]), ['foo>1.0'])
+            self.assertEqual(unsatisfied(['foo'], [other]), ['foo'])
+
+
+class ScriptConstantsTestCase(unittest.TestCase):
+    def test_fnames(self):
+        from venv_bootstrap import cache
+
+        script = script_namespace()
+        fnames = [i for i in dir(cache) if i.endswith('_FNAME')]
+        self.assertEqual([script[i] for i in fnames], [getattr(cache, i) for i in fnames])
+
+
+@unittest.skipUnless(os.name == 'posix', 'POSIX only')
+class ServerAddressTestCase(unittest.TestCase):
+    def test_long_tmpdir(self):
+        server_address = script_namespace()['server_address']
+
+        with tempfile.TemporaryDirectory() as venv:
+            for i in ['venv-bootstrap.stamp', 'venv-bootstrap.install']:
+                with open(os.path.join(venv, i), 'w') as f:
+                    f.write('x\n')
+
+            env = dict(os.environ)
+            env.pop('XDG_RUNTIME_DIR', None)
+            # as on macOS
+            env['TMPDIR'] = os.path.join(venv, 'T' * 80)
+
+            with unittest.mock.patch.dict(os.environ, env, clear=True):
+                address = server_address(venv, 'module', 'install', None)
+
+        self.assertEqual(os.path.dirname(address), '/tmp/venv-bootstrap-{}'.format(os.getuid()))
+        self.assertLess(len(address), 104)
+
+
 class CompletedProcess(object):
     # This is a heavily stripped down version of subprocess.CompletedProcess to be usable with Python 3.4
     def __init__(self, args, returncode, stdout=None, stderr=None):
@@ -188,3 +532,535 @@ class BootstrapTestCase(unittest.TestCase):
         self.assertTrue('\nerror: ' in er.stderr)
         self.assertTrue(MODULE in er.stderr)
         self.assertEqual(er.stdout, '')
+
+    def test_warm_start_stamp(self):
+        MESSAGE = 'stdout message'
+        stamp = os.path.join(os.path.dirname(self._script), '.venv.venv_bootstrap_py_example1', 'venv-bootstrap.stamp')
+        er = self._run_script(['venv_bootstrap_py_example1', self._example1_dir, 'succeed', MESSAGE])
+        self.assertEqual(er.returncode, 0)
+        with open(stamp) as f:
+            contents = f.read()
+        self.assertTrue('\nenv_exe ' in contents)
+
+        # a stale stamp must cause the venv to be recreated and the stamp rewritten
+        with open(stamp, 'w') as f:
+            f.write('bootstrap 0.0\n')
+        er = self._run_script(['venv_bootstrap_py_example1', self._example1_dir, 'succeed', MESSAGE])
+        self.assertEqual(er.returncode, 0)
+        self.assertEqual(er.stdout, MESSAGE + '\n')
+        with open(stamp) as f:
+            self.assertEqual(f.read(), contents)
+
+    @unittest.skipIf(os.name == 'nt', "exec handoff is not used on Windows")
+    def test_exec_handoff(self):
+        # the module must run in the very process started for venv-bootstrap.py
+        with open(os.path.join(os.path.dirname(self._script), 'print_pid.py'), 'w') as f:
+            f.write('import os\nprint(os.getpid())\n')
+
+        with subprocess.Popen(
+            [sys.executable, self._script, 'print_pid', ''],
+            stdout=subprocess.PIPE,
+            universal_newlines=True
+        ) as process:
+            stdout, _ = process.communicate()
+
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(stdout, '{}\n'.format(process.pid))
+
+    def test_import_error_does_not_reinstall(self):
+        # an ImportError raised by the module itself must not send the bootstrap back to pip
+        with open(os.path.join(os.path.dirname(self._script), 'raise_import_error.py'), 'w') as f:
+            f.write('raise ImportError("raised by the module")\n')
+
+        venv = os.path.join(os.path.dirname(self._script), '.venv.venv_bootstrap_py_example1')
+
+        for i in range(2):
+            er = self._run_script(['--verbose', '--venv', venv, 'raise_import_error', self._example1_dir])
+            self.assertEqual(er.returncode, 2)
+            self.assertTrue('raised by the module' in er.stderr)
+
+        self.assertFalse('using "pip"' in er.stderr)
+
+
+class WheelhouseTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        example1_dir = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'example1')
+
+        cls._tempdir = tempfile.TemporaryDirectory()
+        cls._wheelhouse = os.path.join(cls._tempdir.name, 'wheelhouse')
+        cls._wheelhouse_result = CliRunner().invoke(cli.wheelhouse, [cls._wheelhouse, example1_dir])
+
+        installer = Installer(cls._tempdir.name)
+        installer.install()
+        cls._script = installer.fname
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tempdir.cleanup()
+
+    def _run_example1(self, args, message, python=sys.executable):
+        script_args = ['--wheelhouse', self._wheelhouse, '--no-pip-upgrade'] + args
+        module_args = ['venv_bootstrap_py_example1', 'venv-bootstrap.py-example1', 'succeed', message]
+
+        with subprocess.Popen(
+            [python, self._script] + script_args + module_args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        ) as process:
+            stdout, stderr = process.communicate()
+
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(stdout, message + '\n')
+        return stderr
+
+    def test_offline_install(self):
+        self.assertEqual(self._wheelhouse_result.exit_code, 0)
+        self.assertTrue(any(i.lower().startswith('click-') for i in os.listdir(self._wheelhouse)))
+        self._run_example1(['--venv', os.path.join(self._tempdir.name, 'venv-offline')], 'offline')
+
+    def test_pip_bootstrap(self):
+        cache_dir = os.path.join(self._tempdir.name, 'cache-pip')
+        venv = os.path.join(self._tempdir.name, 'venv-pip')
+        # as made by "venv-bootstrap-wheelhouse --no-pip"
+        wheelhouse = os.path.join(self._tempdir.name, 'wheelhouse-no-pip')
+        os.mkdir(wheelhouse)
+
+        for i in os.listdir(self._wheelhouse):
+            if not i.lower().startswith('pip-'):
+                shutil.copy(os.path.join(self._wheelhouse, i), wheelhouse)
+
+        # not --no-pip-upgrade, while PyPI is unreachable
+        with subprocess.Popen(
+            [sys.executable, self._script, '--verbose', '--wheelhouse', wheelhouse, '--cache-dir', cache_dir, '--venv', venv,
+             'venv_bootstrap_py_example1', 'venv-bootstrap.py-example1', 'succeed', 'offline'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=dict(os.environ, HTTP_PROXY='http://127.0.0.1:9', HTTPS_PROXY='http://127.0.0.1:9'),
+            universal_newlines=True
+        ) as process:
+            stdout, stderr = process.communicate()
+
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(stdout, 'offline\n')
+        self.assertFalse('Retrying' in stderr)
+        self.assertTrue('Importing "pip" from "{}'.format(os.path.join(cache_dir, 'bootstrap-wheels')) in stderr)
+
+        # pip is imported from the cache rather than installed
+        for root, dirs, files in os.walk(venv):
+            self.assertFalse(any(i == 'pip' or i.lower().startswith('pip-') for i in dirs), root)
+
+    def test_lock(self):
+        lock = os.path.join(self._tempdir.name, 'venv_bootstrap_py_example1'.join(['venv-bootstrap.', '.lock']))
+        self._run_example1(['--lock', '--venv', os.path.join(self._tempdir.name, 'venv-lock1')], 'record')
+
+        with open(lock) as f:
+            lines = f.read().splitlines()
+
+        self.assertTrue(any(i.lower().startswith('click==') and '--hash=sha256:' in i for i in lines))
+
+        # replay in another venv
+        self._run_example1(['--lock', '--venv', os.path.join(self._tempdir.name, 'venv-lock2')], 'replay')
+
+        with open(lock) as f:
+            self.assertEqual(f.read().splitlines(), lines)
+
+    def test_template(self):
+        cache_dir = os.path.join(self._tempdir.name, 'cache')
+        venv1 = os.path.join(self._tempdir.name, 'venv-template1')
+        venv2 = os.path.join(self._tempdir.name, 'venv-template2')
+
+        self._run_example1(['--verbose', '--template', '--cache-dir', cache_dir, '--venv', venv1], 'seed')
+        self.assertEqual(len(os.listdir(os.path.join(cache_dir, 'templates'))), 1)
+
+        stderr = self._run_example1(['--verbose', '--template', '--cache-dir', cache_dir, '--venv', venv2], 'clone')
+        self.assertFalse('using "pip"' in stderr)
+
+        with open(os.path.join(venv2, 'pyvenv.cfg')) as f:
+            self.assertFalse(cache_dir in f.read())
+
+    def test_store(self):
+        cache_dir = os.path.join(self._tempdir.name, 'cache-store')
+        venvs = [os.path.join(self._tempdir.name, 'venv-store{}'.format(i)) for i in range(2)]
+
+        for i in venvs:
+            self._run_example1(['--store', '--cache-dir', cache_dir, '--venv', i], 'store')
+
+        def click_init(venv):
+            return [
+                os.path.join(root, 'click', '__init__.py')
+                for root, dirs, files in os.walk(venv) if 'click' in dirs and not os.path.islink(root)
+            ][0]
+
+        self.assertTrue(os.path.samefile(click_init(venvs[0]), click_init(venvs[1])))
+
+        store_dir = os.path.join(cache_dir, 'store')
+        entries = os.listdir(store_dir)
+
+        result = CliRunner().invoke(cli.prune_store, ['--cache-dir', cache_dir])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(os.listdir(store_dir), entries)
+
+        shutil.rmtree(venvs[0])
+        shutil.rmtree(venvs[1])
+
+        for root, dirs, files in os.walk(store_dir):
+            if os.path.basename(root) == 'refs':
+                for i in files:
+                    os.utime(os.path.join(root, i), (0, 0))
+
+        result = CliRunner().invoke(cli.prune_store, ['--cache-dir', cache_dir])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(os.listdir(store_dir), [])
+
+    def test_concurrent(self):
+        venv = os.path.join(self._tempdir.name, 'venv-concurrent')
+
+        processes = [
+            subprocess.Popen(
+                [
+                    sys.executable, self._script, '--wheelhouse', self._wheelhouse, '--no-pip-upgrade', '--verbose',
+                    '--venv', venv, 'venv_bootstrap_py_example1', 'venv-bootstrap.py-example1', 'succeed', 'concurrent'
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True
+            )
+            for i in range(4)
+        ]
+
+        installs = 0
+
+        for process in processes:
+            with process:
+                stdout, stderr = process.communicate()
+            self.assertEqual(process.returncode, 0)
+            self.assertEqual(stdout, 'concurrent\n')
+            installs += 'using "pip"' in stderr
+
+        self.assertEqual(installs, 1)
+
+    def test_timing(self):
+        timing = os.path.join(self._tempdir.name, 'timing.jsonl')
+        self._run_example1(['--timing', timing, '--venv', os.path.join(self._tempdir.name, 'venv-timing')], 'timing')
+
+        with open(timing) as f:
+            records = [json.loads(i) for i in f]
+
+        self.assertEqual([i['role'] for i in records], ['parent', 'install', 'child'])
+        self.assertTrue('venv' in records[0]['phases'])
+        self.assertTrue(all(i in records[1]['phases'] for i in ['spawn', 'pip_install']))
+        self.assertTrue(all(i in records[2]['phases'] for i in ['spawn', 'import']))
+        self.assertFalse('pip_install' in records[2]['phases'])
+
+    def test_precompile(self):
+        venv = os.path.join(self._tempdir.name, 'venv-precompile')
+        self._run_example1(['--unchecked-hash-pyc', '--venv', venv], 'precompile')
+
+        pycs = [
+            os.path.join(root, i)
+            for root, dirs, files in os.walk(venv) if root.endswith(os.path.join('click', '__pycache__'))
+            for i in files
+        ]
+        self.assertTrue(pycs)
+
+        if sys.version_info >= (3, 7):
+            # flags of unchecked hash-based .pyc files
+            with open(pycs[0], 'rb') as f:
+                self.assertEqual(f.read(8)[4:], b'\x01\x00\x00\x00')
+
+    def test_bundle(self):
+        venv = os.path.join(self._tempdir.name, 'venv-bundle')
+        self._run_example1(['--bundle', '--venv', venv], 'bundle')
+
+        with zipfile.ZipFile(os.path.join(venv, 'venv-bootstrap.bundle.zip')) as z:
+            names = z.namelist()
+
+        self.assertTrue('click/__init__.pyc' in names)
+        self.assertFalse(any(i.startswith('pip/') for i in names))
+
+        self._run_example1(['--bundle', '--venv', venv], 'bundled')
+
+    @unittest.skipUnless(os.name == 'posix', 'POSIX only')
+    def test_server(self):
+        timing = os.path.join(self._tempdir.name, 'timing-server.jsonl')
+        venv = os.path.join(self._tempdir.name, 'venv-server')
+        args = ['--server', '--server-timeout', '10', '--timing', timing, '--venv', venv]
+        self._run_example1(args, 'start')
+
+        # the server is started in the background
+        for i in range(20):
+            self._run_example1(args, 'served')
+
+            with open(timing) as f:
+                if json.loads(f.readlines()[-1]).get('server'):
+                    break
+
+            time.sleep(0.5)
+        else:
+            self.fail('no invocation was served')
+
+    def test_manifest(self):
+        script_dir = os.path.join(self._tempdir.name, 'manifest')
+        os.mkdir(script_dir)
+        installer = Installer(script_dir)
+        installer.install()
+
+        with open(os.path.join(script_dir, 'venv-bootstrap.json'), 'w') as f:
+            json.dump({
+                'environments': {
+                    'tools': {
+                        'modules': ['venv_bootstrap_py_example1', 'venv_bootstrap_py_example1.__main__'],
+                        'install': 'venv-bootstrap.py-example1'
+                    }
+                }
+            }, f)
+
+        installs = 0
+
+        for module in ['venv_bootstrap_py_example1', 'venv_bootstrap_py_example1.__main__']:
+            with subprocess.Popen(
+                [
+                    sys.executable, installer.fname, '--wheelhouse', self._wheelhouse, '--no-pip-upgrade', '--verbose',
+                    module, 'not-installed', 'succeed', 'manifest'
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True
+            ) as process:
+                stdout, stderr = process.communicate()
+
+            self.assertEqual(process.returncode, 0)
+            self.assertEqual(stdout, 'manifest\n')
+            installs += 'using "pip"' in stderr
+
+        self.assertEqual(installs, 1)
+        self.assertEqual([i for i in os.listdir(script_dir) if i.startswith('.venv.')], ['.venv.tools'])
+
+    def test_gc(self):
+        root = os.path.join(self._tempdir.name, 'gc')
+        venv = os.path.join(root, 'venv-gc')
+        self._run_example1(['--venv', venv], 'used')
+        self.assertTrue(os.path.exists(os.path.join(venv, 'venv-bootstrap.used')))
+
+        result = CliRunner().invoke(cli.gc, ['--days', '0', root])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(os.listdir(root), [])
+
+        self._run_example1(['--venv', venv], 'recreated')
+
+    def test_snapshot(self):
+        archives = os.path.join(self._tempdir.name, 'snapshots')
+        venv1 = os.path.join(self._tempdir.name, 'venv-snapshot1')
+        venv2 = os.path.join(self._tempdir.name, 'venv-snapshot2')
+        self._run_example1(['--venv', venv1], 'export')
+
+        result = CliRunner().invoke(cli.snapshot, ['export', venv1, archives])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(os.listdir(archives)), 1)
+
+        spec_args = ['--install', 'venv-bootstrap.py-example1', '--python', sys.executable]
+        result = CliRunner().invoke(cli.snapshot, ['key'] + spec_args)
+        self.assertEqual(os.listdir(archives), [result.output.strip() + '.tar'])
+
+        result = CliRunner().invoke(cli.snapshot, ['import', '--install', 'other'] + spec_args[2:] + [archives, venv2])
+        self.assertEqual(result.exit_code, 1)
+        self.assertFalse(os.path.exists(venv2))
+
+        result = CliRunner().invoke(cli.snapshot, ['import'] + spec_args + [archives, venv2])
+        self.assertEqual(result.exit_code, 0)
+
+        with open(os.path.join(venv2, 'pyvenv.cfg')) as f:
+            self.assertFalse(venv1 in f.read())
+
+        # the restored venv is used as is
+        timing = os.path.join(self._tempdir.name, 'timing-snapshot.jsonl')
+        self._run_example1(['--timing', timing, '--venv', venv2], 'import')
+
+        with open(timing) as f:
+            records = [json.loads(i) for i in f]
+
+        self.assertFalse('venv' in records[0]['phases'])
+        self.assertFalse('pip_install' in records[1]['phases'])
+
+    @unittest.skipIf(os.name == 'nt', "symlinks are not supported on Windows")
+    def test_snapshot_interpreter(self):
+        archives = os.path.join(self._tempdir.name, 'snapshots-interpreter')
+        venv1 = os.path.join(self._tempdir.name, 'venv-snapshot-interpreter1')
+        venv2 = os.path.join(self._tempdir.name, 'venv-snapshot-interpreter2')
+        self._run_example1(['--venv', venv1], 'export')
+
+        result = CliRunner().invoke(cli.snapshot, ['export', venv1, archives])
+        self.assertEqual(result.exit_code, 0)
+
+        # the same interpreter at another location
+        python = os.path.join(self._tempdir.name, 'other-python', 'python')
+        os.mkdir(os.path.dirname(python))
+        os.symlink(os.path.realpath(sys.executable), python)
+
+        spec_args = ['--install', 'venv-bootstrap.py-example1', '--python', python]
+        result = CliRunner().invoke(cli.snapshot, ['import'] + spec_args + [archives, venv2])
+        self.assertEqual(result.exit_code, 0)
+
+        with open(os.path.join(venv2, 'venv-bootstrap.stamp')) as f:
+            self.assertTrue('executable {}\n'.format(python) in f.read())
+
+        with open(os.path.join(venv2, 'pyvenv.cfg')) as f:
+            self.assertTrue('home = {}\n'.format(os.path.dirname(python)) in f.read())
+
+        self.assertEqual(os.readlink(os.path.join(venv2, 'bin', 'python')), python)
+
+        # the restored venv is used as is by the other interpreter
+        timing = os.path.join(self._tempdir.name, 'timing-snapshot-interpreter.jsonl')
+        self._run_example1(['--timing', timing, '--venv', venv2], 'import', python=python)
+
+        with open(timing) as f:
+            records = [json.loads(i) for i in f]
+
+        self.assertFalse('venv' in records[0]['phases'])
+        self.assertFalse('pip_install' in records[1]['phases'])
+
+    def test_prepare(self):
+        venv1 = os.path.join(self._tempdir.name, 'venv-prepare1')
+        venv2 = os.path.join(self._tempdir.name, 'venv-prepare2')
+        entries = os.path.join(self._tempdir.name, 'prepare.json')
+        timing = os.path.join(self._tempdir.name, 'timing-prepare.jsonl')
+
+        with open(entries, 'w') as f:
+            json.dump([
+                dict(module='venv_bootstrap_py_example1', install='venv-bootstrap.py-example1', venv=venv1),
+                dict(module='venv_bootstrap_py_example1', install='venv-bootstrap.py-example1', venv=venv2),
+                dict(module='no_such_module', install='no-such-dist', venv=os.path.join(self._tempdir.name, 'venv-prepare3')),
+            ], f)
+
+        script_args = ['--script-arg=--wheelhouse={}'.format(self._wheelhouse), '--script-arg=--no-pip-upgrade']
+        script_args += ['--script-arg=--timing={}'.format(timing)]
+        result = CliRunner().invoke(cli.prepare, ['--script', self._script, '--jobs', '3'] + script_args + [entries])
+        self.assertEqual(result.exit_code, 1)
+        self.assertTrue('2 venvs prepared, 1 failed' in result.output)
+
+        for venv in [venv1, venv2]:
+            self.assertTrue(os.path.exists(os.path.join(venv, 'venv-bootstrap.install')))
+
+        # no fresh interpreter is run after installing, as there is no module to run
+        with open(timing) as f:
+            self.assertFalse(any(json.loads(i)['role'] == 'install' for i in f))
+
+        # nothing is left to do
+        stderr = self._run_example1(['--verbose', '--venv', venv1], 'prepared')
+        self.assertFalse('using "pip"' in stderr)
+
+    def test_verify(self):
+        venv = os.path.join(self._tempdir.name, 'venv-verify')
+        self._run_example1(['--venv', venv], 'verify')
+
+        result = CliRunner().invoke(cli.verify, [venv])
+        self.assertEqual(result.exit_code, 0)
+
+        click_init = [
+            os.path.join(root, '__init__.py') for root, _, files in os.walk(venv)
+            if os.path.basename(root) == 'click' and '__init__.py' in files
+        ][0]
+
+        with open(click_init, 'a') as f:
+            f.write('# changed\n')
+
+        result = CliRunner().invoke(cli.verify, [venv])
+        self.assertEqual(result.exit_code, 1)
+        self.assertTrue('broken: click-' in result.output)
+
+        result = CliRunner().invoke(cli.verify, ['--repair', '--wheelhouse', self._wheelhouse, venv])
+        self.assertEqual(result.exit_code, 0)
+
+        result = CliRunner().invoke(cli.verify, [venv])
+        self.assertEqual(result.exit_code, 0)
+        self._run_example1(['--venv', venv], 'repaired')
+
+    @unittest.skipIf(os.name != 'posix', 'launchers are tested as shell scripts')
+    def test_launcher(self):
+        venv = os.path.join(self._tempdir.name, 'venv-launcher')
+        launcher = os.path.join(self._tempdir.name, 'example1-launcher')
+        timing = os.path.join(self._tempdir.name, 'timing-launcher.jsonl')
+        self._run_example1(['--launcher', launcher, '--venv', venv], 'bootstrap')
+
+        def launch(message):
+            with subprocess.Popen(
+                [launcher, 'succeed', message],
+                stdout=subprocess.PIPE,
+                env=dict(os.environ, VENV_BOOTSTRAP_PY_TIMING=timing),
+                universal_newlines=True
+            ) as process:
+                stdout, _ = process.communicate()
+
+            self.assertEqual(process.returncode, 0)
+            self.assertEqual(stdout, message + '\n')
+
+        used = os.path.join(venv, 'venv-bootstrap.used')
+        os.utime(used, (0, 0))
+
+        # venv-bootstrap.py is not run at all, yet the venv is marked as used
+        launch('direct')
+        self.assertFalse(os.path.exists(timing))
+        self.assertGreater(os.path.getmtime(used), 0)
+
+        # once the venv is gone, the launcher falls back to venv-bootstrap.py, which makes it again
+        shutil.rmtree(venv)
+        launch('fallback')
+        self.assertTrue(os.path.exists(timing))
+        self.assertTrue(os.path.exists(os.path.join(venv, 'venv-bootstrap.launch')))
+
+    def test_launcher_bundle(self):
+        launcher = os.path.join(self._tempdir.name, 'example1-launcher-bundle')
+
+        with subprocess.Popen(
+            [sys.executable, self._script, '--bundle', '--launcher', launcher, 'venv_bootstrap_py_example1', ''],
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        ) as process:
+            _, stderr = process.communicate()
+
+        self.assertEqual(process.returncode, 2)
+        self.assertTrue('cannot be used with "--bundle"' in stderr)
+        self.assertFalse(os.path.exists(launcher))
+
+    @unittest.skipIf(os.name != 'posix', 'launchers are tested as shell scripts')
+    def test_launcher_server(self):
+        venv = os.path.join(self._tempdir.name, 'venv-launcher-server')
+        launcher = os.path.join(self._tempdir.name, 'example1-launcher-server')
+        timing = os.path.join(self._tempdir.name, 'timing-launcher-server.jsonl')
+        args = ['--server', '--server-timeout', '10', '--timing', timing, '--launcher', launcher, '--venv', venv]
+        self._run_example1(args, 'start')
+
+        # the server, started in the background, has the options of the child
+        for i in range(20):
+            self._run_example1(args, 'served')
+
+            with open(timing) as f:
+                if json.loads(f.readlines()[-1]).get('server'):
+                    break
+
+            time.sleep(0.5)
+        else:
+            self.fail('no invocation was served')
+
+        with open(launcher) as f:
+            fallback = shlex.split([i for i in f.read().splitlines() if i.startswith('exec ')][-1])
+
+        # the options given, rather than those the server was started with
+        options = ['--wheelhouse', self._wheelhouse, '--no-pip-upgrade'] + args
+        options[options.index('10')] = '10.0'
+        self.assertEqual(fallback[2:3] + sorted(fallback[3:-4]), [self._script] + sorted(options))
+        self.assertEqual(fallback[-4:], ['venv_bootstrap_py_example1', 'venv-bootstrap.py-example1', '--', '$@'])
+
+    def test_child_outside_venv(self):
+        # e.g. run by a stale launcher, which must not install into the base interpreter
+        with subprocess.Popen(
+            [sys.executable, self._script, '--child', 'venv_bootstrap_py_example1', 'venv-bootstrap.py-example1'],
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        ) as process:
+            _, stderr = process.communicate()
+
+        self.assertEqual(process.returncode, 2)
+        self.assertTrue('must be run by the interpreter of a venv' in stderr)